@@ -0,0 +1,199 @@
+"""
+Non-blocking 1-Wire bus driven by a hardware timer.
+Copyright (c) 2015, Moklyak Alexandr.
+
+OneWire waits in pyb.udelay() for the end of every time slot, so the
+processor does nothing else while the bus is busy. AsyncOneWire makes one
+time slot in every interrupt of the timer. The reset pulse and the pauses are
+counted in interrupts too. The program gives the transaction to submit() and
+continues, the result comes to the callback:
+>>> from onewire import OneWire, Transaction
+>>> from asyncbus import AsyncOneWire
+>>> ow = AsyncOneWire('X4', 2)
+>>> buff = bytearray(9)
+>>> t = Transaction(None).write(0xbe).read(buff, crc=True)
+>>> def done(ok):
+>>>     print(ok, buff)
+>>> ow.submit(t, rom, done)
+
+In a generator or a coroutine of TimeThread the result is awaited:
+>>> def measure():
+>>>     ok = yield from ow.submit(t, rom)
+>>> async def measure():
+>>>     ok = await ow.submit(t, rom)
+
+The pin works in open drain mode, the bus should have an external pull-up
+resistor. The callback is called by micropython.schedule(), out of the
+interrupt.
+"""
+
+import pyb
+import micropython
+from onewire import crc8, STANDARD_TIMING
+
+# States of the bus
+IDLE = 0
+RESET = 1
+PRESENCE = 2
+RECOVERY = 3
+DATA = 4
+
+class AsyncOneWire(object):
+    # One time slot per interrupt, about 71 us
+    SLOT_FREQ = 14000
+    # Interrupts for the reset pulse and for the pause after the presence
+    RESET_TICKS = 7
+    RECOVERY_TICKS = 6
+    CMD_MATCHROM = 0x55
+    CMD_SKIPROM = 0xcc
+
+    def __init__(self, pinId, timerNum):
+        self.pin = pyb.Pin(pinId, pyb.Pin.OUT_OD, pyb.Pin.PULL_UP)
+        self.pin.value(1)
+        self.value = self.pin.value
+        self.udelay = pyb.udelay
+        # Start of the slot and the sample of the read slot, as in PinBus
+        self.tStart = STANDARD_TIMING[3]
+        self.tSample = STANDARD_TIMING[6]
+        self.timer = pyb.Timer(timerNum)
+        self.select = bytearray(9)
+        self.select[0] = self.CMD_MATCHROM
+        self.skip = bytes((self.CMD_SKIPROM,))
+        self.ops = ()
+        self.state = IDLE
+        self.busy = False
+        self.ok = False
+        self.result = False
+        self.callback = None
+        # Number of the transaction, a late result of the previous one is
+        # not taken for the current one
+        self.gen = 0
+        # Bound methods are made here, the interrupt must not allocate them
+        self._tick_ref = self._tick
+        self._done_ref = self._done
+
+    def submit(self, transaction, rom = None, callback = None):
+        """
+        Start the transaction with the device, or with all devices if the ROM
+        is not given. The callback gets True if the device answered and all
+        CRC checks passed. Returns the bus, which can be awaited for the
+        same result, or raises OSError if the bus is busy.
+        """
+
+        if self.busy and self.state == IDLE:
+            # The previous result was not passed by micropython.schedule()
+            self._done(self.gen)
+        if self.busy:
+            raise OSError('The bus is busy')
+        if rom:
+            for i in range(8):
+                self.select[i + 1] = rom[i]
+            first = (False, self.select, False)
+        else:
+            first = (False, self.skip, False)
+        self.ops = [first] + transaction.steps
+        self.callback = callback
+        self.gen = (self.gen + 1) & 0x3fffffff
+        self.op = 0
+        self.n = 0
+        self.bit = 0
+        self.acc = 0
+        self.hold = False
+        self.busy = True
+        self.count = self.RESET_TICKS
+        self.value(0)
+        self.state = RESET
+        self.timer.init(freq=self.SLOT_FREQ)
+        self.timer.callback(self._tick_ref)
+        return self
+
+    def __iter__(self):
+        while self.busy:
+            if self.state == IDLE:
+                self._done(self.gen)
+            else:
+                yield 1
+        return self.ok
+
+    __await__ = __iter__
+
+    def _finish(self, ok):
+        # Stops the timer and passes the result out of the interrupt. If the
+        # queue of micropython.schedule() is full the result is taken by the
+        # waiting generator or by the next submit().
+        self.timer.callback(None)
+        self.result = ok
+        self.state = IDLE
+        try:
+            micropython.schedule(self._done_ref, self.gen)
+        except Exception:
+            pass
+
+    def _done(self, gen):
+        # Passes the result of the transaction with the number gen, if it is
+        # the current one and is not passed yet.
+        if not self.busy or gen != self.gen:
+            return
+        ok = self.result
+        if ok:
+            for read, buf, crc in self.ops:
+                if crc and crc8(buf):
+                    ok = False
+        self.ok = ok
+        self.busy = False
+        if self.callback:
+            self.callback(ok)
+
+    def _tick(self, timer):
+        # The handler of the timer. It makes one step of the transaction.
+        value = self.value
+        if self.hold:
+            # The end of the slot writing 0
+            value(1)
+            self.hold = False
+        state = self.state
+        if state == DATA:
+            if self.op == len(self.ops):
+                self._finish(True)
+                return
+            read, buf, crc = self.ops[self.op]
+            n = self.n
+            bit = self.bit
+            value(0)
+            self.udelay(self.tStart)
+            if read:
+                value(1)
+                self.udelay(self.tSample)
+                if value():
+                    self.acc |= 1 << bit
+            elif buf[n] & (1 << bit):
+                value(1)
+            else:
+                self.hold = True
+            bit += 1
+            if bit == 8:
+                if read:
+                    buf[n] = self.acc
+                    self.acc = 0
+                bit = 0
+                n += 1
+                if n == len(buf):
+                    n = 0
+                    self.op += 1
+            self.n = n
+            self.bit = bit
+        elif state == RESET:
+            self.count -= 1
+            if self.count == 0:
+                value(1)
+                self.state = PRESENCE
+        elif state == PRESENCE:
+            if value():
+                self._finish(False)
+                return
+            self.count = self.RECOVERY_TICKS
+            self.state = RECOVERY
+        elif state == RECOVERY:
+            self.count -= 1
+            if self.count == 0:
+                self.state = DATA
@@ -0,0 +1,136 @@
+"""
+Monitor of devices attached to the 1-Wire bus.
+Copyright (c) 2015, Moklyak Alexandr.
+
+The monitor searches the bus step by step. Every call of step() makes one
+pass of the search and finds one device, so the bus is never occupied for
+long and the monitor can run in the background of TimeThread. When all
+devices are passed the found list is compared with the known one and the
+handlers are called for the attached and the removed devices:
+>>> from onewire import OneWire
+>>> from busmonitor import BusMonitor
+>>> from timethread import TimeThread
+>>> ow = OneWire('X4')
+>>> def added(rom):
+>>>     print('attached', rom)
+>>> def removed(rom):
+>>>     print('removed', rom)
+>>> mon = BusMonitor(ow, added, removed)
+>>> th = TimeThread(1)
+>>> th.set_interval(100, mon.step)
+>>> th.run()
+
+The list ow.roms is changed in place: the known ROMs keep their objects and
+only the attached and removed ones are added or deleted. If search() gives
+a new list meanwhile, the next round takes the known devices from it.
+With alarm=True the monitor uses the alarm search, then the handlers are
+called when a device raises and clears its alarm flag, and ow.roms is not
+changed.
+"""
+
+class BusMonitor(object):
+    """
+    The monitor of the bus. The family limits the search to the devices of
+    one family. A device is reported as removed when it is missing in the
+    given number of rounds in a row, so a single error on the bus does not
+    remove it.
+    """
+    def __init__(self, onewire, on_add = None, on_remove = None, alarm = False,
+                 family = None, rounds = 2):
+        self.ow = onewire
+        self.on_add = on_add
+        self.on_remove = on_remove
+        self.alarm = alarm
+        if alarm:
+            self.cmd = onewire.CMD_ALARM_SEARCH
+        else:
+            self.cmd = onewire.CMD_SEARCHROM
+        self.prefix = bytes((family,)) if family is not None else None
+        self.rounds = rounds
+        # Known devices and the devices found in the current round
+        self.known = {}
+        self.seen = {}
+        self.missing = {}
+        # The list ow.roms the known devices were taken from
+        self.roms = None
+        self._seed()
+        self.rom = False
+        self.diff = 65
+
+    def _seed(self):
+        # Takes the known devices from ow.roms. search() replaces the list,
+        # then the devices found by it are known too.
+        roms = self.ow.roms
+        self.roms = roms
+        if self.alarm:
+            return
+        family = self.prefix[0] if self.prefix else None
+        known = {}
+        for rom in roms:
+            if family is None or rom[0] == family:
+                known[bytes(rom)] = rom
+        self.known = known
+
+    def step(self):
+        """
+        Makes one pass of the search. Returns True when the round is
+        finished and the handlers are called.
+        """
+
+        if self.diff == 65 and self.ow.roms is not self.roms:
+            self._seed()
+        rom, self.diff = self.ow._search_rom(self.rom, self.diff, self.cmd,
+                                             self.prefix)
+        if rom:
+            self.rom = rom
+            if self.ow.crc8(rom) == 0:
+                key = bytes(rom)
+                self.seen[key] = self.known.get(key, rom)
+        if self.diff == 0:
+            self._finish()
+            return True
+        return False
+
+    def _finish(self):
+        # Compares the found devices with the known ones.
+        known = self.known
+        seen = self.seen
+        missing = self.missing
+        roms = self.ow.roms
+        # Only the full search gives the list for ow.roms
+        update = not self.alarm and self.prefix is None
+        changed = False
+        for key in known:
+            if key in seen:
+                missing.pop(key, None)
+                continue
+            n = missing.get(key, 0) + 1
+            if n < self.rounds:
+                missing[key] = n
+                seen[key] = known[key]
+                continue
+            missing.pop(key, None)
+            rom = known[key]
+            if update and rom in roms:
+                roms.remove(rom)
+                changed = True
+            if self.on_remove:
+                self.on_remove(rom)
+        for key in seen:
+            if key in known:
+                continue
+            rom = seen[key]
+            if update and rom not in roms:
+                roms.append(rom)
+                changed = True
+            if self.on_add:
+                self.on_add(rom)
+        if changed and self.ow.cache:
+            try:
+                self.ow.save_roms()
+            except OSError:
+                pass
+        self.known = seen
+        self.seen = {}
+        self.rom = False
+        self.diff = 65
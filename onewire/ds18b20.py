@@ -8,88 +8,343 @@ assumes the ground of your DS18B20 is connected to VCC and GND and the data
 pin is connected to X4.
 WARNING: There should not be any activity on the tire when using the parasite
 power during the temperature conversion.
+The conversion takes from 94 ms at 9 bits to 750 ms at 12 bits. The sensors
+with external power answer 1 in the read slots when the conversion is done,
+so wait_measure() polls the bus and returns as soon as the data is ready.
+The parasite powered sensors are waited for the time of their resolution,
+which is known from the last full reading of the scratchpad, 12 bits
+otherwise. is_ready() makes the same check without waiting.
+The configuration of every device is kept from the full readings, so
+get_config() and the time of the conversion need no traffic on the bus.
+Writing or loading the configuration forgets it until the next reading.
+set_config_all() and save_config_all() work with all devices at once.
 EXAMPLES:
 1. Only one device is connected:
->>> import pyb
 >>> from ds18b20 import DS18B20
 >>> from onewire import OneWire
 >>> ow = OneWire('X4')
 >>> ds = DS18B20(ow)
 >>> ds.start_measure()
->>> pyb.delay(750)
+>>> ds.wait_measure()
 >>> print(ds.get_temp())
 2. Output of data from all devices on the wire:
->>> import pyb
 >>> from ds18b20 import DS18B20
 >>> from onewire import OneWire
 >>> ow = OneWire('X4')
 >>> ds = DS18B20(ow)
 >>> ds.start_measure()
 >>> roms = ds.search()
->>> pyb.delay(750)
+>>> ds.wait_measure()
 >>> temps = []
 >>> for rom in roms:
 >>>     temps += [ds.get_temp(rom)]
 >>> print(temps)
+3. Reading of all devices at once. One command starts the conversion on all
+devices, then the scratchpads are read one after another into one buffer.
+The temperatures are in 1/16 of degree, errors[n] is 1 if the device n did
+not answer or its data is damaged. The arrays are reused by the next call:
+>>> temps, errors = ds.read_all()
+>>> for n in range(len(temps)):
+>>>     if not errors[n]:
+>>>         print(ds.roms[n], temps[n] / 16)
+4. Fast reading. Only the two bytes of the temperature are read instead of
+the whole scratchpad, the data is not checked by CRC. Every 8th reading is
+the full one, and so is the reading of a strange value:
+>>> ds.set_fast_read(8)
+>>> print(ds.get_temp())
+5. Integer temperatures. get_temp16() gives 1/16 of degree and get_temp100()
+gives 1/100 of degree, both make no float and return None on error. With
+the history length given, read_temps() and read_all() put every value into
+the history of its device, ds.histories[n] is for ds.roms[n]:
+>>> ds = DS18B20(ow, history=60)
+>>> ds.read_all()
+>>> h = ds.histories[0]
+>>> print(h.last(), h.min, h.max, h.mean())
 """
 
+from array import array
+
+class TempHistory(object):
+    """
+    The last values of the temperature in the ring of fixed size. The
+    minimum, the maximum and the sum of the values in the ring are kept while
+    the values are added, so nothing is allocated.
+    """
+    def __init__(self, size):
+        self.values = array('h', [0] * size)
+        self.clear()
+
+    def clear(self):
+        self.pos = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """
+        Put the value into the ring instead of the oldest one.
+        """
+
+        values = self.values
+        size = len(values)
+        pos = self.pos
+        old = values[pos]
+        full = self.count == size
+        values[pos] = value
+        self.pos = (pos + 1) % size
+        if full:
+            self.total += value - old
+        else:
+            self.count += 1
+            self.total += value
+        if self.min is None or value <= self.min:
+            self.min = value
+        elif full and old == self.min:
+            self._rescan()
+            return
+        if self.max is None or value >= self.max:
+            self.max = value
+        elif full and old == self.max:
+            self._rescan()
+
+    def _rescan(self):
+        # The oldest value was the minimum or the maximum, they are found
+        # again among all values.
+        values = self.values
+        lo = hi = values[0]
+        for v in values:
+            if v < lo:
+                lo = v
+            elif v > hi:
+                hi = v
+        self.min = lo
+        self.max = hi
+
+    def last(self):
+        """
+        The last added value or None.
+        """
+
+        if not self.count:
+            return None
+        return self.values[self.pos - 1]
+
+    def mean(self):
+        """
+        The mean of the values in the ring rounded down, or None.
+        """
+
+        if not self.count:
+            return None
+        return self.total // self.count
+
+    def __len__(self):
+        return self.count
+
 class DS18B20(object):
     THERM_CMD_CONVERTTEMP = 0x44
     THERM_CMD_RSCRATCHPAD = 0xbe
     THERM_CMD_WSCRATCHPAD = 0x4e
     THERM_CMD_CSCRATCHPAD = 0x48
     THERM_CMD_ESCRATCHPAD = 0xb8
+    THERM_CMD_RPOWERSUPPLY = 0xb4
+    # Time of the conversion in ms for 9, 10, 11 and 12 bits
+    CONVERSION_TIME = (94, 188, 375, 750)
     
-    def __init__(self, onewire):
+    def __init__(self, onewire, history = 0):
+        import pyb
+        self.millis = pyb.millis
+        self.elapsed_millis = pyb.elapsed_millis
+        self.delay = pyb.delay
         self.ow = onewire
+        # Configuration of the devices by ROMs: TH, TL and the configuration
+        # register, which is 0 while it is not known
+        self.configs = {}
+        self.entries = []
+        # Entries of the ROMs of the bus, item n is for the object ow.roms[n]
+        self.bus_roms = None
+        self.bus_count = 0
+        self.bus_entries = []
+        self.bus_pos = 0
+        self.full = False
+        # All devices have the external power: True, False or None if unknown
+        self.powered = None
+        # The current conversion: start time, time to wait and number of the
+        # reset after the command
+        self.converting = False
+        self.start = 0
+        self.wait = 0
+        self.resets = 0
         self.buff = bytearray(9)
+        self.config = bytearray(4)
+        self.config[0] = self.THERM_CMD_WSCRATCHPAD
+        # Every operation is one transaction with one reset of the bus
+        self.t_convert = onewire.transaction().write(self.THERM_CMD_CONVERTTEMP)
+        self.t_read = onewire.transaction().write(self.THERM_CMD_RSCRATCHPAD).read(self.buff, True)
+        self.t_write = onewire.transaction().write(self.config)
+        self.t_save = onewire.transaction().write(self.THERM_CMD_CSCRATCHPAD)
+        self.t_load = onewire.transaction().write(self.THERM_CMD_ESCRATCHPAD)
+        self.t_power = onewire.transaction().write(self.THERM_CMD_RPOWERSUPPLY)
+        # Results of read_all() and the planned reads of every device
+        self.roms = []
+        self.pads = bytearray(0)
+        self.temps = array('h')
+        self.errors = bytearray(0)
+        self.t_reads = []
+        self.views = []
+        self.history = history
+        self.histories = []
+        # Fast reading of the two bytes of the temperature
+        self.fast_every = 0
+        self.fast_count = 0
+        self.fast_low = -55 * 16
+        self.fast_high = 125 * 16
+        self.t_fast = onewire.transaction().write(self.THERM_CMD_RSCRATCHPAD).read(memoryview(self.buff)[:2])
+        self.t_fasts = []
         
-    def _match_rom(self, rom = False):
-        # The method checks if the tire is ready to work, defines which 
-        # ROM to work with, and sends a command to select the active device
-        # with this key. As a result, the method returns the ROM of the
-        # selected device or False if the operation can not be continued.
+    def _get_rom(self, rom = False):
+        # The method defines which ROM to work with. If the ROM is not given
+        # then the first thermometer on the list is taken. As a result, the
+        # method returns the ROM or False if there is no thermometer.
         
-        if not self.ow.reset():
-            return False
         if not rom:
             roms = self.ow.dev_list(0x28)
             if len(roms) > 0:
                 rom = roms[0]
+        return rom or False
+        
+    def _conversion_time(self, rom):
+        # Time of the conversion for the resolution of the device. For all
+        # devices it is the time of the slowest known one.
+
         if rom:
-            self.ow.match_rom(rom)
-            return rom
+            bits = self._bits(self._entry_of(rom))
         else:
-            return False
-        
+            entries = self._bus_entries()
+            if not entries:
+                bits = 12
+            else:
+                bits = 9
+                for entry in entries:
+                    if entry is not None:
+                        b = self._bits(entry)
+                        if b > bits:
+                            bits = b
+        return self.CONVERSION_TIME[bits - 9]
+
+    def _bits(self, entry):
+        # Resolution from the cached configuration, 12 bits if not known.
+
+        if not entry[2]:
+            return 12
+        return ((entry[2] >> 5) & 3) + 9
+
+    def _entry(self, rom):
+        # The cached configuration of the device.
+
+        key = bytes(rom)
+        entry = self.configs.get(key)
+        if entry is None:
+            entry = bytearray(3)
+            self.configs[key] = entry
+        return entry
+
+    def _bus_entries(self):
+        # The entries of the ROMs of the bus, None for other families. They
+        # are made again only when the list of ROMs changes.
+
+        ow = self.ow
+        roms = ow.roms or ow.families.get(0x28) or []
+        if roms is not self.bus_roms or len(roms) != self.bus_count:
+            self.bus_roms = roms
+            self.bus_count = len(roms)
+            self.bus_entries = [self._entry(r) if r[0] == 0x28 else None for r in roms]
+            self.bus_pos = 0
+        return self.bus_entries
+
+    def _entry_of(self, rom):
+        # The cached configuration of the ROM object. The ROMs of the bus are
+        # found by identity without allocation. The search starts after the
+        # last found one, so reading the devices in order finds each at once.
+
+        entries = self._bus_entries()
+        roms = self.bus_roms
+        count = len(roms)
+        pos = self.bus_pos
+        for i in range(count):
+            n = pos + i
+            if n >= count:
+                n -= count
+            if roms[n] is rom and entries[n] is not None:
+                self.bus_pos = n + 1
+                return entries[n]
+        return self._entry(rom)
+
+    def read_power(self):
+        """
+        Check that all devices on the wire have the external power. Any
+        parasite powered device answers 0. Returns True, False, or None if no
+        device answered.
+        """
+
+        if not self.t_power.run():
+            return None
+        self.powered = self.ow.read_bit() == 1
+        return self.powered
+
     def start_measure(self, rom = False):
         """
         Method sends a command to device to measure temperature. After this
-        method is called, need to wait 750ms before reading the data.
+        method is called, need to wait for the end of the conversion by
+        wait_measure() or is_ready() before reading the data.
         If the device is not specified, the command is sent to all devices
         on the wire.
         """
         
-        if not self.ow.reset():
+        if self.powered is None:
+            self.read_power()
+        self.converting = False
+        if not self.t_convert.run(rom or None):
             return False
-        if rom:
-            self.ow.match_rom(rom)
-        else:
-            self.ow.write_byte(self.ow.CMD_SKIPROM)
-        self.ow.write_byte(self.THERM_CMD_CONVERTTEMP)
+        self.converting = True
+        self.resets = self.ow.resets
+        self.start = self.millis()
+        self.wait = self._conversion_time(rom)
         return True
+
+    def is_ready(self):
+        """
+        Check without waiting that the conversion started by start_measure()
+        is done. The powered devices are asked by a read slot while the bus
+        was not reset by other operations, otherwise the time of the
+        conversion is counted.
+        """
+
+        if not self.converting:
+            return True
+        if self.elapsed_millis(self.start) >= self.wait:
+            self.converting = False
+        elif self.powered and self.ow.resets == self.resets:
+            if self.ow.read_bit():
+                self.converting = False
+        return not self.converting
+
+    def wait_measure(self):
+        """
+        Wait for the end of the conversion started by start_measure().
+        """
+
+        while not self.is_ready():
+            self.delay(1)
     
     def _get_data(self, rom):
         # It returns the content of the memory device.
         
-        if self._match_rom(rom):
-            self.ow.write_byte(self.THERM_CMD_RSCRATCHPAD)
-        else:
-            return False
-        for i in range(9):
-            self.buff[i] = self.ow.read_byte()
-        if self.ow.crc8(self.buff):
+        rom = self._get_rom(rom)
+        if not rom:
             return False
+        return self.t_read.run(rom)
         
     def get_temp(self, rom = False):
         """
@@ -98,36 +353,211 @@ class DS18B20(object):
         (method search() is automaticly colled). 
         """
         
-        if self._get_data(rom) == False:
+        value = self.get_temp16(rom)
+        if value is None:
             return False
-        
-        return (self.buff[1] << 8 | self.buff[0]) / 16
+        return value / 16
 
-    def get_config(self, rom = False):
+    def get_temp16(self, rom = False):
+        """
+        Reads the temperature like get_temp() and returns the signed integer
+        in 1/16 of degree, or None on error.
+        """
+
+        rom = self._get_rom(rom)
+        if not rom:
+            return None
+        value = self._read_temp(rom, self.buff, self.t_read, self.t_fast, self._fast_turn())
+        if self.full:
+            entry = self._entry_of(rom)
+            buff = self.buff
+            entry[0] = buff[2]
+            entry[1] = buff[3]
+            entry[2] = buff[4]
+        return value
+
+    def get_temp100(self, rom = False):
+        """
+        Reads the temperature like get_temp() and returns the signed integer
+        in 1/100 of degree, or None on error.
+        """
+
+        value = self.get_temp16(rom)
+        if value is None:
+            return None
+        return (value * 25 + 2) >> 2
+
+    def _plan_reads(self, count):
+        # Makes the buffers for the given number of devices and a read
+        # transaction for every device into its own part of the buffer.
+
+        self.pads = bytearray(9 * count)
+        self.temps = array('h', [0] * count)
+        self.errors = bytearray(count)
+        view = memoryview(self.pads)
+        self.views = [view[n * 9:n * 9 + 9] for n in range(count)]
+        self.t_reads = [self.ow.transaction().write(self.THERM_CMD_RSCRATCHPAD).read(v, True)
+                        for v in self.views]
+        self.t_fasts = [self.ow.transaction().write(self.THERM_CMD_RSCRATCHPAD).read(v[:2])
+                        for v in self.views]
+        if self.history:
+            self.histories = [TempHistory(self.history) for n in range(count)]
+        self.entries = []
+
+    def set_fast_read(self, every = 16, low = -55 * 16, high = 125 * 16):
+        """
+        Switch on the fast reading of the temperature: only the two bytes of
+        the temperature are read, without CRC. Every Nth reading is the full
+        one with CRC. A value out of the range from low to high (in 1/16 of
+        degree), the 85 degrees of the power on and the value of the empty
+        bus are read again in full. every = 0 switches the fast reading off.
+        """
+
+        self.fast_every = every
+        self.fast_count = 0
+        self.fast_low = low
+        self.fast_high = high
+
+    def _fast_turn(self):
+        # Counts the readings. Returns True if this reading may be fast.
+
+        every = self.fast_every
+        if not every:
+            return False
+        self.fast_count += 1
+        if self.fast_count >= every:
+            self.fast_count = 0
+            return False
+        return True
+
+    def _read_temp(self, rom, buf, t_full, t_fast, fast):
+        # Reads the temperature into the buffer by the fast or the full
+        # transaction. Returns the signed value in 1/16 of degree or None.
+        # self.full tells that the whole scratchpad is read.
+
+        self.full = False
+        if fast and t_fast.run(rom):
+            value = buf[1] << 8 | buf[0]
+            if value & 0x8000:
+                value -= 0x10000
+            # 0x550 is 85 degrees of the power on, -1 is the empty bus
+            if self.fast_low <= value <= self.fast_high and value != 0x550 and value != -1:
+                return value
+        if not t_full.run(rom):
+            return None
+        self.full = True
+        value = buf[1] << 8 | buf[0]
+        if value & 0x8000:
+            value -= 0x10000
+        return value
+
+    def read_temps(self, roms = None):
+        """
+        Read the temperatures of the devices after the conversion. If the
+        ROMs are not given then the devices of the previous call are read,
+        at the first call all thermometers on the list. After a new search
+        give ow.dev_list(0x28) to read the new list.
+        Returns the arrays of temperatures in 1/16 of degree and of error
+        flags, item n is for roms[n]. The arrays are reused by every call
+        while the number of devices is the same.
+        """
+
+        if roms is None:
+            roms = self.roms or self.ow.dev_list(0x28)
+        if len(roms) != len(self.t_reads):
+            self._plan_reads(len(roms))
+        elif roms != self.roms:
+            # Other devices, the old values are not theirs
+            for h in self.histories:
+                h.clear()
+            self.entries = []
+        if not self.entries:
+            self.entries = [self._entry_of(rom) for rom in roms]
+        self.roms = roms
+        histories = self.histories
+        entries = self.entries
+        temps = self.temps
+        errors = self.errors
+        views = self.views
+        t_reads = self.t_reads
+        t_fasts = self.t_fasts
+        # One sweep of all devices is one reading for the fast mode
+        fast = self._fast_turn()
+        for n in range(len(roms)):
+            value = self._read_temp(roms[n], views[n], t_reads[n], t_fasts[n], fast)
+            if value is None:
+                errors[n] = 1
+            else:
+                temps[n] = value
+                errors[n] = 0
+                if self.full:
+                    entry = entries[n]
+                    view = views[n]
+                    entry[0] = view[2]
+                    entry[1] = view[3]
+                    entry[2] = view[4]
+                if histories:
+                    histories[n].add(value)
+        return temps, errors
+
+    def read_all(self, roms = None):
+        """
+        Start the conversion on all devices by one command, wait for it and
+        read the temperatures like read_temps().
+        """
+
+        if roms is None:
+            roms = self.roms or self.ow.dev_list(0x28)
+        if self.start_measure():
+            self.wait_measure()
+        return self.read_temps(roms)
+
+    def get_config(self, rom = False, cached = True):
         """
         The method determines the configuration that is stored in the RAM
         device. If the device is not specified then reading is done from first
         thermometer on the list (method search() is automaticly colled).
+        The configuration known from the last full reading is returned
+        without reading, cached = False reads it anyway.
         The result of the method is the tuple:
             - maximum temperature alarm
             - minimum temperature alarm
             - bit temperature measurement (9-12 bits)
         """
         
-        if self._get_data(rom) == False:
+        rom = self._get_rom(rom)
+        if not rom:
             return False
+        entry = self._entry_of(rom)
+        if not (cached and entry[2]):
+            if self._get_data(rom) == False:
+                return False
+            entry[:] = self.buff[2:5]
 
-        max_temp = self.buff[2]
+        # The alarm temperatures are signed bytes
+        max_temp = entry[0]
         if max_temp & (1<<7):
-            max_temp = -max_temp
+            max_temp -= 256
             
-        min_temp = self.buff[3]
+        min_temp = entry[1]
         if min_temp & (1<<7):
-            min_temp = -min_temp
+            min_temp -= 256
 
-        bit = (self.buff[4] >> 5) + 9
+        bit = ((entry[2] >> 5) & 3) + 9
         return(max_temp, min_temp, bit)
 
+    def _set_config(self, max_temp, min_temp, bit):
+        # Puts the configuration into the buffer of the write transaction.
+
+        config = 0b00011111 #9bit
+        if bit == 10: config |= (1<<5) #10bit
+        elif bit == 11: config |= (1<<6) #11bit
+        elif bit == 12: config |= (1<<5) | (1<<6) #12bit
+        
+        self.config[1] = max_temp & 0xff
+        self.config[2] = min_temp & 0xff
+        self.config[3] = config
+
     def set_config(self, rom, max_temp, min_temp, bit):
         """
         Installing the configuration of the thermometer. Set upper and lower
@@ -136,23 +566,31 @@ class DS18B20(object):
         set in the range of 9-12 bits.
         """
         
-        if (max_temp < 0):
-            max_temp = abs(max_temp) | (1<<7)
-        if (min_temp < 0):
-            min_temp = abs(min_temp) | (1<<7)
-
-        config = 0b00011111 #9bit
-        if bit == 10: config |= (1<<5) #10bit
-        elif bit == 11: config |= (1<<6) #11bit
-        elif bit == 12: config |= (1<<5) | (1<<6) #12bit
-        
-        if self._match_rom(rom):
-            self.ow.write_byte(self.THERM_CMD_WSCRATCHPAD)
-            self.ow.write_byte(max_temp)
-            self.ow.write_byte(min_temp)
-            self.ow.write_byte(config)            
-        else:
+        rom = self._get_rom(rom)
+        if not rom:
             return False
+        self._set_config(max_temp, min_temp, bit)
+        self._entry_of(rom)[2] = 0
+        return self.t_write.run(rom)
+
+    def set_config_all(self, max_temp, min_temp, bit):
+        """
+        Installing the same configuration to all devices on the wire by one
+        command, like set_config().
+        """
+
+        self._set_config(max_temp, min_temp, bit)
+        for entry in self.configs.values():
+            entry[2] = 0
+        return self.t_write.run()
+
+    def save_config_all(self):
+        """
+        Store the configuration of all devices on the wire in their EEPROM
+        by one command.
+        """
+
+        return self.t_save.run()
 
     def save_config(self, rom = False):
         """
@@ -161,10 +599,10 @@ class DS18B20(object):
         power.
         """
         
-        if self._match_rom(rom):        
-            self.ow.write_byte(self.THERM_CMD_CSCRATCHPAD)
-        else:
+        rom = self._get_rom(rom)
+        if not rom:
             return False
+        return self.t_save.run(rom)
 
     def load_config(self, rom = False):
         """
@@ -172,7 +610,9 @@ class DS18B20(object):
         the device.
         """
         
-        if self._match_rom(rom):
-            self.ow.write_byte(self.THERM_CMD_ESCRATCHPAD)
-        else:
+        rom = self._get_rom(rom)
+        if not rom:
             return False
+        # The configuration comes from EEPROM and is not known any more
+        self._entry_of(rom)[2] = 0
+        return self.t_load.run(rom)
@@ -1,16 +1,41 @@
+"""
+HomeSensor driver.
+Copyright (c) 2015, Moklyak Alexandr.
+
+CMD_READ_DATA gives one value and its CRC8. CMD_READ_FRAME gives all values
+of the device in one transaction: the number of values, the values and the
+CRC8 of all these bytes. The values are read into a buffer made in advance:
+>>> hs = HomeSensor(ow)
+>>> n = hs.get_frame()
+>>> if n is not False:
+>>>     print(hs.frame[:n])
+read_all() reads the frames of all devices, the values of device n are
+hs.frames[n][:counts[n]]:
+>>> counts, errors = hs.read_all()
+"""
+
+from onewire import CRC8_TABLE
+
 class HomeSensor(object):
     CMD_READ_DATA = 0xA0
+    CMD_READ_FRAME = 0xA1
     
-    def __init__(self, onewire):
+    def __init__(self, onewire, size = 16):
         self.ow = onewire
         self.roms = []
+        self.buff = bytearray(2)
+        self.t_read = onewire.transaction().write(self.CMD_READ_DATA).read(self.buff, True)
+        # The largest frame and the buffer for it with the CRC byte
+        self.size = size
+        self.frame = bytearray(size + 1)
+        self.cmd = bytes((self.CMD_READ_FRAME,))
+        # Frames of read_all()
+        self.frames = []
+        self.counts = bytearray(0)
+        self.errors = bytearray(0)
         
     def search(self):
-        self.roms = []        
-        for rom in self.ow.search():
-            if rom[0] == 0xF0:
-                self.roms += [rom]
-                
+        self.roms = self.ow.search_family(0xF0)
         return self.roms
 
     def _get_first(self):
@@ -23,23 +48,64 @@ class HomeSensor(object):
             return None
         
     def get_data(self, rom = False):
-        if not self.ow.reset():
-            return False
-        
         if not rom:
             rom = self._get_first()
-            
-        if rom:
-            self.ow.match_rom(rom)
-            self.ow.write_byte(self.CMD_READ_DATA)
-        else:
+        if not rom:
             return False
-        
-        buff = bytearray(2)
-        for i in range(2):
-            buff[i] = self.ow.read_byte()
 
-        if self.ow.crc8(buff):
+        if not self.t_read.run(rom):
+            return False
+
+        return self.buff[0]
+
+    def _read_frame(self, rom, buf):
+        # Reads the frame of the device into the buffer. Returns the number
+        # of values or False if the device did not answer, the frame is
+        # longer than the buffer or the CRC is wrong.
+
+        ow = self.ow
+        if not ow.select(rom):
+            return False
+        ow.write_bytes(self.cmd)
+        read_byte = ow.read_byte
+        table = CRC8_TABLE
+        n = read_byte()
+        if n > self.size:
+            return False
+        crc = table[n]
+        for i in range(n + 1):
+            b = read_byte()
+            buf[i] = b
+            crc = table[crc ^ b]
+        if crc:
             return False
+        return n
 
-        return buff[0]
+    def get_frame(self, rom = False):
+        if not rom:
+            rom = self._get_first()
+        if not rom:
+            return False
+
+        return self._read_frame(rom, self.frame)
+
+    def read_all(self):
+        if len(self.roms) == 0:
+            self.search()
+        roms = self.roms
+        if len(roms) != len(self.frames):
+            self.frames = [bytearray(self.size + 1) for rom in roms]
+            self.counts = bytearray(len(roms))
+            self.errors = bytearray(len(roms))
+        frames = self.frames
+        counts = self.counts
+        errors = self.errors
+        for i in range(len(roms)):
+            n = self._read_frame(roms[i], frames[i])
+            if n is False:
+                counts[i] = 0
+                errors[i] = 1
+            else:
+                counts[i] = n
+                errors[i] = 0
+        return counts, errors
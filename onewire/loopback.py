@@ -0,0 +1,71 @@
+"""
+The stand-in for pyb.UART to run UartBus on a desktop computer.
+Copyright (c) 2015, Moklyak Alexandr.
+
+LoopbackUart returns every written byte as the echo like the half-duplex
+wiring of UartBus does. Without devices the bus stays free: the reset gets no
+answer and every read slot gives 1. The devices are given as a bus model with
+two methods:
+    reset() - returns True if any device answers with the presence pulse;
+    slot(bit) - makes one time slot in which the master writes the bit
+                (1 for a read slot) and returns the level of the bus;
+    advance(us) - optional, moves the time of the model by the duration of
+                  every byte.
+>>> from onewire import OneWire, UartBus
+>>> from loopback import LoopbackUart
+>>> ow = OneWire(UartBus(LoopbackUart(model)))
+>>> print(ow.search())
+"""
+
+class LoopbackUart(object):
+    def __init__(self, model = None):
+        self.model = model
+        self.baudrate = 0
+        self.echo = bytearray()
+
+    def init(self, baudrate, **kwargs):
+        self.baudrate = baudrate
+
+    def any(self):
+        return len(self.echo)
+
+    def read(self, n = -1):
+        if n < 0:
+            n = len(self.echo)
+        data = bytes(self.echo[:n])
+        del self.echo[:n]
+        return data
+
+    def write(self, buf):
+        for b in buf:
+            self.echo.append(self._line(b))
+        return len(buf)
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.echo))
+        if n == 0:
+            return None
+        buf[:n] = self.echo[:n]
+        del self.echo[:n]
+        return n
+
+    def _line(self, b):
+        # Echo of the byte after the devices on the bus have pulled it down.
+        if self.model is None:
+            return b
+        if hasattr(self.model, 'advance'):
+            # Start, 8 data and stop bits
+            self.model.advance(10000000 // self.baudrate)
+        if self.baudrate < 115200:
+            # The byte 0xf0 at low speed is the reset pulse. The presence
+            # pulse of a device pulls down the upper bits of the echo.
+            if self.model.reset():
+                return b & 0xe0
+            return b
+        # The byte 0xff is the write 1 or read slot, a device that answers 0
+        # holds the bus down during the first bits of the byte. The byte 0x00
+        # is the write 0 slot.
+        bit = b & 1
+        if self.model.slot(bit) or not bit:
+            return b
+        return b & 0xfc
@@ -0,0 +1,197 @@
+"""
+Driver of several 1-Wire buses working in parallel.
+Copyright (c) 2015, Moklyak Alexandr.
+
+Every bus is connected to its own pin, all pins should belong to one GPIO
+port. The pins work in open drain mode and are switched together by the
+registers of the port, so a time slot is made on all buses at once and the
+bit of every bus is taken from one read of the port. The reset, the command
+and the reading of the data take the time of one bus whatever the number of
+buses.
+
+The example measures the temperature by one DS18B20 on every bus:
+>>> import pyb
+>>> from multibus import MultiOneWire
+>>> from ds18b20 import DS18B20
+>>> mw = MultiOneWire(['X1', 'X2', 'X3', 'X4'])
+>>> mw.command(DS18B20.THERM_CMD_CONVERTTEMP)
+>>> pyb.delay(750)
+>>> bufs = [bytearray(9) for i in range(4)]
+>>> present = mw.read(DS18B20.THERM_CMD_RSCRATCHPAD, bufs)
+Bit n of present is set if bus n answered the reset. If there are several
+devices on a bus, the ROM of the device is given for every bus:
+>>> present = mw.read(DS18B20.THERM_CMD_RSCRATCHPAD, bufs, roms)
+"""
+
+import pyb
+import stm
+import micropython
+from array import array
+
+class MultiOneWire(object):
+    CMD_MATCHROM = 0x55
+    CMD_SKIPROM = 0xcc
+
+    def __init__(self, pinIds):
+        self.pins = [pyb.Pin(p, pyb.Pin.OUT_OD, pyb.Pin.PULL_UP) for p in pinIds]
+        port = self.pins[0].gpio()
+        self.bits = array('H', [0] * len(self.pins))
+        self.mask = 0
+        for n in range(len(self.pins)):
+            if self.pins[n].gpio() != port:
+                raise ValueError('All pins should belong to one port')
+            self.bits[n] = 1 << self.pins[n].pin()
+            self.mask |= self.bits[n]
+        # The lower half of BSRR sets the pins, the upper half clears them.
+        self.set_reg = port + stm.GPIO_BSRR
+        self.clear_reg = port + stm.GPIO_BSRR + 2
+        self.in_reg = port + stm.GPIO_IDR
+        self.samples = array('H', [0] * 8)
+        self.ones = array('H', [0] * 8)
+        self.byte = bytearray(1)
+        stm.mem16[self.set_reg] = self.mask
+
+    @micropython.native
+    def reset(self):
+        """
+        Perform the reset function on all buses. The result has bit n set if
+        bus n answered with the presence pulse.
+        """
+
+        mem16 = stm.mem16
+        udelay = pyb.udelay
+        mask = self.mask
+        mem16[self.clear_reg] = mask
+        udelay(480)
+        i = pyb.disable_irq()
+        mem16[self.set_reg] = mask
+        udelay(60)
+        value = mem16[self.in_reg]
+        pyb.enable_irq(i)
+        udelay(420)
+        present = 0
+        bits = self.bits
+        for n in range(len(bits)):
+            if not value & bits[n]:
+                present |= 1 << n
+        return present
+
+    @micropython.native
+    def _write(self, ones):
+        # Makes 8 write slots. Item b of ones is the mask of pins that write 1
+        # in slot b, the rest of pins write 0.
+
+        mem16 = stm.mem16
+        udelay = pyb.udelay
+        mask = self.mask
+        set_reg = self.set_reg
+        clear_reg = self.clear_reg
+        i = pyb.disable_irq()
+        for b in range(8):
+            mem16[clear_reg] = mask
+            udelay(1)
+            mem16[set_reg] = ones[b]
+            udelay(60)
+            mem16[set_reg] = mask
+            udelay(1)
+        pyb.enable_irq(i)
+
+    def write_bytes(self, buf):
+        """
+        Write the same bytes to all buses.
+        """
+
+        ones = self.ones
+        mask = self.mask
+        for value in buf:
+            for b in range(8):
+                ones[b] = mask if value & (1 << b) else 0
+            self._write(ones)
+
+    def write_bytes_each(self, bufs):
+        """
+        Write own bytes to every bus. Item n of bufs is the buffer for bus n,
+        all buffers should have the same length.
+        """
+
+        ones = self.ones
+        bits = self.bits
+        for i in range(len(bufs[0])):
+            for b in range(8):
+                m = 0
+                for n in range(len(bits)):
+                    if bufs[n][i] & (1 << b):
+                        m |= bits[n]
+                ones[b] = m
+            self._write(ones)
+
+    @micropython.native
+    def readinto(self, bufs):
+        """
+        Read bytes from all buses. Item n of bufs is the buffer for bus n,
+        all buffers should have the same length.
+        """
+
+        mem16 = stm.mem16
+        udelay = pyb.udelay
+        mask = self.mask
+        set_reg = self.set_reg
+        clear_reg = self.clear_reg
+        in_reg = self.in_reg
+        samples = self.samples
+        bits = self.bits
+        for i in range(len(bufs[0])):
+            irq = pyb.disable_irq()
+            for b in range(8):
+                mem16[clear_reg] = mask
+                udelay(1)
+                mem16[set_reg] = mask
+                udelay(1)
+                samples[b] = mem16[in_reg]
+                udelay(40)
+            pyb.enable_irq(irq)
+            for n in range(len(bits)):
+                bit = bits[n]
+                value = 0
+                for b in range(8):
+                    if samples[b] & bit:
+                        value |= 1 << b
+                bufs[n][i] = value
+
+    def select(self, roms = None):
+        """
+        Reset all buses and select the device with the ROM from roms on every
+        bus. All devices are selected if roms is not given. Returns the mask
+        of answered buses.
+        """
+
+        present = self.reset()
+        if roms:
+            self.byte[0] = self.CMD_MATCHROM
+            self.write_bytes(self.byte)
+            self.write_bytes_each(roms)
+        else:
+            self.byte[0] = self.CMD_SKIPROM
+            self.write_bytes(self.byte)
+        return present
+
+    def command(self, cmd, roms = None):
+        """
+        Send the command to the selected devices of all buses. Returns the
+        mask of answered buses.
+        """
+
+        present = self.select(roms)
+        self.byte[0] = cmd
+        self.write_bytes(self.byte)
+        return present
+
+    def read(self, cmd, bufs, roms = None):
+        """
+        Send the command and read the answer of every bus into its buffer.
+        Returns the mask of answered buses.
+        """
+
+        present = self.command(cmd, roms)
+        self.readinto(bufs)
+        return present
@@ -1,25 +1,102 @@
 """
 OneWire library.
 Copyright (c) 2015, Moklyak Alexandr.
+
+OneWire works with the bus through a transport object. PinBus makes the time
+slots by the program on any pin. Its write_bytes() and readinto() disable the
+interrupts once per byte and are compiled to native code, so the time slots
+stay close to the specification even for long reads. UartBus makes the slots
+by a hardware UART and does not load the processor by delays:
+>>> from onewire import OneWire, UartBus
+>>> ow = OneWire(UartBus(4))
+>>> print(ow.search())
+Every transport has methods reset(), write_bit(), read_bit(), write_bytes()
+and readinto(). LoopbackUart from loopback.py stands in for the UART on a
+desktop computer.
+
+The found ROMs can be kept in a file, so the bus is not searched again after
+every start. The file is written by search() when the list changes:
+>>> ow = OneWire('X4', cache='/flash/roms.bin')
+>>> roms = ow.load_roms()
+load_roms() takes the ROMs from the file without the bus. New or removed
+devices are found by search(). With verify=True every ROM is checked on the
+bus, but this takes as long as the search itself.
+
+An operation with a device is planned once as a Transaction and then run as
+many times as needed. Every run makes one reset, selects the device and
+makes the planned writes and reads:
+>>> buff = bytearray(9)
+>>> t = ow.transaction().write(0xbe).read(buff, crc=True)
+>>> if t.run(rom):
+>>>     print(buff)
 """
 
-import pyb
-from pyb import disable_irq
-from pyb import enable_irq
+try:
+    import micropython
+except ImportError:
+    # Desktop Python: the code emitters are not available
+    class micropython(object):
+        @staticmethod
+        def native(f):
+            return f
 
-class OneWire(object):
-    CMD_SEARCHROM = 0xf0
-    CMD_ALARM_SEARCH = 0xec
-    CMD_READROM = 0x33
-    CMD_MATCHROM = 0x55
-    CMD_SKIPROM = 0xcc
+from array import array
+
+def _crc_table(poly, size):
+    # Table of the reflected CRC for every value of the byte.
+    table = array(size, [0] * 256)
+    for i in range(256):
+        crc = i
+        for b in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+        table[i] = crc
+    return table
+
+CRC8_TABLE = _crc_table(0x8c, 'B')
+CRC16_TABLE = _crc_table(0xa001, 'H')
+
+def crc8(data, crc = 0):
+    """
+    Dallas CRC8 of the data. The CRC of the previous part of the data can be
+    given to continue the calculation. The CRC of data ending with its own
+    CRC is 0.
+    """
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
 
+def crc16(data, crc = 0):
+    """
+    CRC16 of the data used by 1-Wire memory devices. The CRC of the previous
+    part of the data can be given to continue the calculation. The devices
+    send the inverted value of this CRC.
+    """
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+    return crc
+
+# Time intervals in microseconds: reset pulse, presence sample, rest of reset,
+# start of slot, write slot, recovery, read sample, rest of read slot.
+STANDARD_TIMING = (480, 60, 420, 1, 60, 1, 1, 40)
+OVERDRIVE_TIMING = (70, 8, 40, 1, 7, 1, 1, 7)
+
+class PinBus(object):
+    """
+    The transport which makes the time slots by the program on one pin.
+    """
     def __init__(self, pinId):
-        self.roms = []
+        import pyb
+        self.set_speed(False)
         self.pin = pyb.Pin(pinId)
         self.pin.init(self.pin.IN, self.pin.PULL_UP)
         # Optimisation of stabilisation of time intervals
-        self.links = (self.pin, pyb.udelay, self.pin.init, self.pin.value, self.pin.OUT_PP, self.pin.IN)
+        self.links = (self.pin, pyb.udelay, self.pin.init, self.pin.value, self.pin.OUT_PP, self.pin.IN,
+                      pyb.disable_irq, pyb.enable_irq)
 
     def reset(self):
         """
@@ -27,36 +104,57 @@ class OneWire(object):
         """
         
         # Optimisation of stabilisation of time intervals
-        pin, udelay, pinInit, pinValue, pinOUT, pinIN = self.links
+        pin, udelay, pinInit, pinValue, pinOUT, pinIN, disable_irq, enable_irq = self.links
+
+        tReset = self.tReset
+        tPresence = self.tPresence
+        tRest = self.tRest
 
         pinValue(0)
         pinInit(pinOUT)
-        udelay(480)
+        udelay(tReset)
         i = disable_irq()
         pinInit(pinIN, pin.PULL_UP)
-        udelay(60)
+        udelay(tPresence)
         status = not pinValue()
         enable_irq(i)
-        udelay(420)
+        udelay(tRest)
         return status
 
+    def set_speed(self, overdrive):
+        """
+        Switch the time slots to overdrive or standard speed. Returns False
+        if the speed is not supported.
+        """
+
+        self.overdrive = overdrive
+        self.timing = OVERDRIVE_TIMING if overdrive else STANDARD_TIMING
+        # The intervals are taken apart once here, the slots only read them
+        (self.tReset, self.tPresence, self.tRest, self.tStart, self.tSlot,
+         self.tRecovery, self.tSample, self.tReadRest) = self.timing
+        return True
+
     def write_bit(self, value):
         """
         Write a single bit.
         """
         
         # Optimisation of stabilisation of time intervals
-        pin, udelay, pinInit, pinValue, pinOUT, pinIN = self.links
+        pin, udelay, pinInit, pinValue, pinOUT, pinIN, disable_irq, enable_irq = self.links
+
+        tStart = self.tStart
+        tSlot = self.tSlot
+        tRecovery = self.tRecovery
 
         i = disable_irq()
         pinValue(0)
         pinInit(pinOUT)
-        udelay(1)
+        udelay(tStart)
         if value:
             pinValue(1)
-        udelay(60)
+        udelay(tSlot)
         pinValue(1)
-        udelay(1)
+        udelay(tRecovery)
         enable_irq(i)
 
     def read_bit(self):
@@ -65,49 +163,372 @@ class OneWire(object):
         """
 
         # Optimisation of stabilisation of time intervals
-        pin, udelay, pinInit, pinValue, pinOUT, pinIN = self.links
+        pin, udelay, pinInit, pinValue, pinOUT, pinIN, disable_irq, enable_irq = self.links
+
+        tStart = self.tStart
+        tSample = self.tSample
+        tRest = self.tReadRest
 
         pinInit(pinIN, pin.PULL_UP) # Half of the packages are not matching by CRC whitout this line
         i = disable_irq()
         pinValue(0)
         pinInit(pinOUT)
-        udelay(1)
+        udelay(tStart)
         pinInit(pinIN, pin.PULL_UP)
-        udelay(1)
+        udelay(tSample)
         value = pinValue()
         enable_irq(i)
-        udelay(40)
+        udelay(tRest)
         return value
 
+    @micropython.native
+    def write_bytes(self, buf):
+        """
+        Write all bytes of the buffer.
+        """
+
+        # Optimisation of stabilisation of time intervals
+        pin, udelay, pinInit, pinValue, pinOUT, pinIN, disable_irq, enable_irq = self.links
+
+        tStart = self.tStart
+        tSlot = self.tSlot
+        tRecovery = self.tRecovery
+
+        pinValue(1)
+        pinInit(pinOUT)
+        for value in buf:
+            i = disable_irq()
+            for b in range(8):
+                pinValue(0)
+                udelay(tStart)
+                if value & 1:
+                    pinValue(1)
+                udelay(tSlot)
+                pinValue(1)
+                udelay(tRecovery)
+                value >>= 1
+            enable_irq(i)
+
+    @micropython.native
+    def readinto(self, buf):
+        """
+        Read bytes into the buffer. The length of the buffer sets the number
+        of read bytes.
+        """
+
+        # Optimisation of stabilisation of time intervals
+        pin, udelay, pinInit, pinValue, pinOUT, pinIN, disable_irq, enable_irq = self.links
+        pullUp = pin.PULL_UP
+        tStart = self.tStart
+        tSample = self.tSample
+        tRest = self.tReadRest
+
+        for n in range(len(buf)):
+            pinInit(pinIN, pullUp) # Half of the packages are not matching by CRC whitout this line
+            value = 0
+            i = disable_irq()
+            for b in range(8):
+                pinValue(0)
+                pinInit(pinOUT)
+                udelay(tStart)
+                pinInit(pinIN, pullUp)
+                udelay(tSample)
+                if pinValue():
+                    value |= 1 << b
+                udelay(tRest)
+            enable_irq(i)
+            buf[n] = value
+
+class UartBus(object):
+    """
+    The transport which makes the time slots by a hardware UART. TX and RX
+    should be connected to the bus in half-duplex mode, TX through an open
+    drain buffer or a diode. The reset pulse is the byte 0xf0 sent at 9600
+    baud, a time slot is the byte 0xff (write 1 or read) or 0x00 (write 0) at
+    115200 baud. The bits are taken from the echo.
+    """
+    RESET_BAUDRATE = 9600
+    SLOT_BAUDRATE = 115200
+
+    def __init__(self, uart):
+        if type(uart) == int:
+            import pyb
+            uart = pyb.UART(uart)
+        self.uart = uart
+        self.slots = bytearray(8)
+        self.slot = bytearray(1)
+        self.overdrive = False
+        self.baudrate = 0
+        self._baudrate(self.SLOT_BAUDRATE)
+
+    def _baudrate(self, baudrate):
+        if self.baudrate != baudrate:
+            self.uart.init(baudrate, bits=8, parity=None, stop=1, timeout=10)
+            self.baudrate = baudrate
+
+    def set_speed(self, overdrive):
+        """
+        Only the standard speed is supported by the UART, so the method
+        returns False for overdrive.
+        """
+
+        return not overdrive
+
+    def _transfer(self, slots):
+        # Sends the slots and reads their echo into the same buffer. If the
+        # echo is lost the bus is seen as pulled down.
+        uart = self.uart
+        while uart.any():
+            uart.read()
+        uart.write(slots)
+        if uart.readinto(slots) != len(slots):
+            for i in range(len(slots)):
+                slots[i] = 0
+
+    def reset(self):
+        """
+        Perform the onewire reset function.
+        """
+
+        slot = self.slot
+        self._baudrate(self.RESET_BAUDRATE)
+        slot[0] = 0xf0
+        self._transfer(slot)
+        self._baudrate(self.SLOT_BAUDRATE)
+        return slot[0] != 0xf0 and slot[0] != 0
+
+    def write_bit(self, value):
+        """
+        Write a single bit.
+        """
+
+        slot = self.slot
+        slot[0] = 0xff if value else 0
+        self._transfer(slot)
+
+    def read_bit(self):
+        """
+        Read a single bit
+        """
+
+        slot = self.slot
+        slot[0] = 0xff
+        self._transfer(slot)
+        return 1 if slot[0] == 0xff else 0
+
+    def write_bytes(self, buf):
+        """
+        Write all bytes of the buffer.
+        """
+
+        slots = self.slots
+        for value in buf:
+            for b in range(8):
+                slots[b] = 0xff if value & 1 else 0
+                value >>= 1
+            self._transfer(slots)
+
+    def readinto(self, buf):
+        """
+        Read bytes into the buffer. The length of the buffer sets the number
+        of read bytes.
+        """
+
+        slots = self.slots
+        for n in range(len(buf)):
+            for b in range(8):
+                slots[b] = 0xff
+            self._transfer(slots)
+            value = 0
+            for b in range(8):
+                if slots[b] == 0xff:
+                    value |= 1 << b
+            buf[n] = value
+
+class OneWire(object):
+    """
+    The driver of the 1-Wire bus. The bus is given as the transport object or
+    as the name of the pin for PinBus. The cache is the name of the file for
+    the list of ROMs.
+    """
+    CMD_SEARCHROM = 0xf0
+    CMD_ALARM_SEARCH = 0xec
+    CMD_READROM = 0x33
+    CMD_MATCHROM = 0x55
+    CMD_SKIPROM = 0xcc
+    CMD_OD_SKIPROM = 0x3c
+    CMD_OD_MATCHROM = 0x69
+
+    def __init__(self, bus, cache = None):
+        if not hasattr(bus, 'reset'):
+            bus = PinBus(bus)
+        self.bus = bus
+        self.cache = cache
+        self.roms = []
+        # ROMs found by search_family() while the full list is not known
+        self.families = {}
+        # Devices known to work at overdrive speed and at standard speed
+        # only. They are lists, so a ROM is found without allocation.
+        self.od_roms = []
+        self.std_roms = []
+        self.byte = bytearray(1)
+        # Number of resets, it shows whether the bus was used by somebody
+        self.resets = 0
+
+    def reset(self):
+        """
+        Perform the onewire reset function.
+        """
+
+        self.resets += 1
+        return self.bus.reset()
+
+    def write_bit(self, value):
+        """
+        Write a single bit.
+        """
+
+        self.bus.write_bit(value)
+
+    def read_bit(self):
+        """
+        Read a single bit
+        """
+
+        return self.bus.read_bit()
+
+    def write_bytes(self, buf):
+        """
+        Write all bytes of the buffer.
+        """
+
+        self.bus.write_bytes(buf)
+
+    def readinto(self, buf):
+        """
+        Read bytes into the buffer. The length of the buffer sets the number
+        of read bytes.
+        """
+
+        self.bus.readinto(buf)
+
+    def readinto_crc8(self, buf, crc = 0):
+        """
+        Read bytes into the buffer and return their CRC8. The CRC is counted
+        while the bytes arrive, so the result is ready with the last byte.
+        If the buffer ends with the CRC byte then 0 means correct data.
+        """
+
+        byte = self.byte
+        readinto = self.bus.readinto
+        table = CRC8_TABLE
+        for i in range(len(buf)):
+            readinto(byte)
+            buf[i] = byte[0]
+            crc = table[crc ^ byte[0]]
+        return crc
+
     def write_byte(self, value):
         """
         Write a byte.
         """
 
-        for i in range(8):
-            self.write_bit(value & 1)
-            value >>= 1
+        self.byte[0] = value
+        self.bus.write_bytes(self.byte)
 
     def read_byte(self):
         """
         Read a single byte and return the value as an integer.
         """
 
-        value = 0
-        for i in range(8):
-            bit = self.read_bit()
-            value |= bit << i
-        #self.pin.init(self.pin.IN, self.pin.PULL_UP)
-        return value
+        self.bus.readinto(self.byte)
+        return self.byte[0]
 
     def search(self):
         """
         Return a list of ROMs for all attached devices.
         """
 
-        self.roms = self._search_roms(self.CMD_SEARCHROM)
+        roms = self._search_roms(self.CMD_SEARCHROM)
+        changed = roms != self.roms
+        self.roms = roms
+        self.families = {}
+        if self.cache and changed:
+            try:
+                self.save_roms()
+            except OSError:
+                # The cache is lost, but the bus is searched
+                pass
         return self.roms
 
+    def verify(self, rom):
+        """
+        Check that the device with the ROM is attached. It takes one pass of
+        the search with all bits of the ROM fixed.
+        """
+
+        return self._search_rom(False, 65, self.CMD_SEARCHROM, rom)[0] is not None
+
+    def save_roms(self, fileName = None):
+        """
+        Write the list of ROMs to the file. The file holds 8 bytes per ROM.
+        """
+
+        f = open(fileName or self.cache, 'wb')
+        try:
+            for rom in self.roms:
+                f.write(rom)
+        finally:
+            f.close()
+
+    def load_roms(self, fileName = None, verify = False):
+        """
+        Read the list of ROMs from the file. If verify is set then every ROM
+        is checked on the bus and the bus is searched again if a device is
+        missing. One check is one pass of the search, so the verification
+        takes as long as search() and gives no speedup. The bus is also
+        searched if there is no file or it can not be read.
+        """
+
+        roms = []
+        fileName = fileName or self.cache
+        data = b''
+        if fileName:
+            try:
+                f = open(fileName, 'rb')
+                try:
+                    data = f.read()
+                finally:
+                    f.close()
+            except OSError:
+                pass
+        for i in range(0, len(data) - 7, 8):
+            rom = bytearray(data[i:i + 8])
+            if self.crc8(rom):
+                roms = []
+                break
+            roms += [rom]
+        if not roms:
+            return self.search()
+        if verify:
+            for rom in roms:
+                if not self.verify(rom):
+                    return self.search()
+        self.roms = roms
+        self.families = {}
+        return self.roms
+
+    def search_family(self, family_code):
+        """
+        Return a list of ROMs for attached devices with pointed family code.
+        The first byte of the ROM is fixed during the search, so only the
+        devices of this family are passed.
+        """
+
+        roms = self._search_roms(self.CMD_SEARCHROM, bytes((family_code,)))
+        self.families[family_code] = roms
+        return roms
+
     def alarm_search(self):
         """
         Return a list of ROMs for all attached devices with alarm flag.
@@ -115,44 +536,58 @@ class OneWire(object):
 
         return self._search_roms(self.CMD_ALARM_SEARCH)
     
-    def _search_roms(self, cmd):
-        # Return a list of ROMs for all attached devices after command CMD
+    def _search_roms(self, cmd, prefix = None):
+        # Return a list of ROMs for all attached devices after command CMD.
+        # If prefix is set then only ROMs starting with it are searched.
         
         res = []
         diff = 65
         rom = False
         for i in range(0xff):
-            rom, diff = self._search_rom(rom, diff, cmd)
-            if rom:
+            rom, diff = self._search_rom(rom, diff, cmd, prefix)
+            if rom and not crc8(rom): # Damaged ROMs are skipped
                 res += [rom]
             if diff == 0:
                 break
         return res
     
-    def _search_rom(self, l_rom, diff, cmd):
-        # Utility method for search of ROMs.
+    def _search_rom(self, l_rom, diff, cmd, prefix = None):
+        # Utility method for search of ROMs. Bits of the prefix are chosen
+        # at collisions, and the search ends if no device has them.
         
+        if self.bus.overdrive:
+            self.bus.set_speed(False)
         if not self.reset():
             return None, 0
         self.write_byte(cmd)
         if not l_rom:
             l_rom = bytearray(8)
+        read_bit = self.bus.read_bit
+        write_bit = self.bus.write_bit
+        fixed = 64 - len(prefix) * 8 if prefix else 64
         rom = bytearray(8)
         next_diff = 0
         i = 64
         for byte in range(8):
             r_b = 0
             for bit in range(8):
-                b = self.read_bit()
-                if self.read_bit():                    
+                b = read_bit()
+                if read_bit():                    
                     if b: # There are no devices or there is a mistake on the wire
                         return None, 0
+                    if i > fixed and (prefix[byte] >> bit) & 1:
+                        return None, 0
+                elif i > fixed:
+                    need = (prefix[byte] >> bit) & 1
+                    if b and not need:
+                        return None, 0
+                    b = need
                 else:               
                     if not b: # Collision. Two devices with different bit meaning
                         if diff > i or ((l_rom[byte] & (1 << bit)) and (diff != i)):
                             b = 1
                             next_diff = i
-                self.write_bit(b)
+                write_bit(b)
                 if b:
                     r_b |= (1<<bit)
                 i -= 1
@@ -161,22 +596,134 @@ class OneWire(object):
 
     def match_rom(self, rom):
         """
-        Select a specific device to talk to.
+        Select a specific device to talk to. The device that works at
+        overdrive speed is selected at overdrive speed, any other device
+        returns the bus to standard speed.
         """
         
-        self.reset()        
-        self.write_byte(self.CMD_MATCHROM)
+        return self.select(rom)
+
+    def select(self, rom = None):
+        """
+        Reset the bus and select the device with the ROM, or all devices if
+        the ROM is not given. Returns False if no device answered the reset,
+        then nothing is sent.
+        The device that worked at overdrive speed is switched to it again if
+        the bus has returned to standard speed meanwhile. If there is no
+        answer at overdrive speed, the bus drops to standard speed and tries
+        once more, and the device is remembered as a standard one.
+        """
+
+        bus = self.bus
+        if rom:
+            if rom in self.od_roms:
+                if not bus.overdrive:
+                    if self._overdrive(self.CMD_OD_MATCHROM, rom):
+                        self.write_byte(self.CMD_MATCHROM)
+                        bus.write_bytes(rom)
+                        return True
+                    self._set_standard(rom)
+            elif bus.overdrive:
+                bus.set_speed(False)
+        if not self.reset():
+            if not bus.overdrive:
+                return False
+            bus.set_speed(False)
+            if rom:
+                self._set_standard(rom)
+            if not self.reset():
+                return False
+        if rom:
+            self.write_byte(self.CMD_MATCHROM)
+            bus.write_bytes(rom)
+        else:
+            self.write_byte(self.CMD_SKIPROM)
+        return True
+
+    def transaction(self):
+        """
+        Returns a new empty transaction on this bus.
+        """
+
+        return Transaction(self)
+
+    def standard_speed(self):
+        """
+        Return the bus and all devices to the standard speed.
+        """
+
+        self.bus.set_speed(False)
+        return self.reset()
+
+    def overdrive_skip_rom(self):
+        """
+        Switch all devices that support it to the overdrive speed and address
+        them all. If no device answers at overdrive speed then the bus returns
+        to standard speed, the skip ROM command is sent and False is returned.
+        """
+
+        if self._overdrive(self.CMD_OD_SKIPROM, None):
+            self.write_byte(self.CMD_SKIPROM)
+            return True
+        self.standard_speed()
+        self.write_byte(self.CMD_SKIPROM)
+        return False
+
+    def overdrive_match_rom(self, rom):
+        """
+        Switch the device to the overdrive speed and select it. If the device
+        does not answer at overdrive speed then it is selected at standard
+        speed, remembered as a standard device and False is returned.
+        """
+
+        if rom not in self.std_roms and self._overdrive(self.CMD_OD_MATCHROM, rom):
+            if rom not in self.od_roms:
+                self.od_roms.append(bytes(rom))
+            self.write_byte(self.CMD_MATCHROM)
+            self.bus.write_bytes(rom)
+            return True
+        self._set_standard(rom)
+        self.select(rom)
+        return False
+
+    def _set_standard(self, rom):
+        # Remembers the device as working at standard speed only.
+
+        if rom in self.od_roms:
+            self.od_roms.remove(rom)
+        if rom not in self.std_roms:
+            self.std_roms.append(bytes(rom))
+
+    def _overdrive(self, cmd, rom):
+        # Sends the overdrive command at standard speed and checks the
+        # presence of devices at overdrive speed. On failure the bus is left
+        # at standard speed.
         
-        for byte in rom:
-            self.write_byte(byte)
+        bus = self.bus
+        if not bus.set_speed(True):
+            return False
+        bus.set_speed(False)
+        if self.reset():
+            self.write_byte(cmd)
+            bus.set_speed(True)
+            if rom:
+                bus.write_bytes(rom)
+            if self.reset():
+                return True
+        bus.set_speed(False)
+        return False
 
     def dev_list(self, family_code):
         """
-        Returns a list of devices with pointed family code.
+        Returns a list of devices with pointed family code. If the full list
+        of devices is not known yet then only this family is searched.
         """
     
         if len(self.roms) == 0:
-            self.search()
+            roms = self.families.get(family_code)
+            if not roms:
+                roms = self.search_family(family_code)
+            return roms
         roms = []
         for rom in self.roms:
             if rom[0] == family_code:
@@ -188,15 +735,61 @@ class OneWire(object):
         Check CRC.
         """
 
-        crc = 0
-        for i in range(len(data)):
-            byte = data[i]
-            for b in range(8):
-                fb_bit = (crc ^ byte) & 0x01
-                if fb_bit == 0x01:
-                    crc = crc ^ 0x18
-                crc = (crc >> 1) & 0x7f
-                if fb_bit == 0x01:
-                    crc = crc | 0x80
-                byte = byte >> 1                
-        return crc
+        return crc8(data)
+
+    def crc16(self, data):
+        """
+        CRC16 of the data.
+        """
+
+        return crc16(data)
+
+class Transaction(object):
+    """
+    The planned sequence of one operation with a device. The methods write()
+    and read() add steps and return the transaction, so the plan is written
+    in one line. The buffers are given at planning, so running allocates no
+    memory.
+    """
+    def __init__(self, onewire):
+        self.ow = onewire
+        self.steps = []
+
+    def write(self, data):
+        """
+        Add writing of the byte or of all bytes of the buffer.
+        """
+
+        if type(data) == int:
+            data = bytes((data,))
+        self.steps += [(False, data, False)]
+        return self
+
+    def read(self, buf, crc = False):
+        """
+        Add reading into the buffer. If crc is set then the last byte of the
+        buffer should be the CRC8 of the rest and it is checked.
+        """
+
+        self.steps += [(True, buf, crc)]
+        return self
+
+    def run(self, rom = None):
+        """
+        Run the transaction with the device, or with all devices if the ROM is
+        not given. Returns False if no device answered or a CRC is wrong.
+        """
+
+        ow = self.ow
+        if not ow.select(rom):
+            return False
+        bus = ow.bus
+        for read, buf, crc in self.steps:
+            if not read:
+                bus.write_bytes(buf)
+            elif crc:
+                if ow.readinto_crc8(buf):
+                    return False
+            else:
+                bus.readinto(buf)
+        return True
@@ -0,0 +1,291 @@
+"""
+Background sampling of 1-Wire sensors.
+Copyright (c) 2015, Moklyak Alexandr.
+
+The sampler measures DS18B20 thermometers and HomeSensor devices on any
+number of buses in the background of TimeThread. Every sensor has its own
+interval. The work is cut into short steps: the conversion is started by one
+step, the following steps check that it is done without waiting, and then
+the sensors are read a few per step. So the bus never holds the thread for
+long. The last values are kept in a table and are taken without the bus:
+>>> from onewire import OneWire
+>>> from ds18b20 import DS18B20
+>>> from home_sensor import HomeSensor
+>>> from timethread import TimeThread
+>>> from sampler import Sampler
+>>> th = TimeThread(1)
+>>> s = Sampler(th)
+>>> s.add_ds18b20(DS18B20(OneWire('X4')), 1000)
+>>> s.add_ds18b20(DS18B20(OneWire('X5')), 10000)
+>>> s.add_home_sensor(HomeSensor(OneWire('X5')), 500)
+>>> s.start()
+>>> def show():
+>>>     for rom in s.roms:
+>>>         print(rom, s.get(rom))
+>>> th.set_interval(5000, show)
+>>> th.run()
+
+The temperatures are in 1/16 of degree as given by DS18B20.get_temp16().
+The table is made of arrays: values[n] is the last value of the sensor
+roms[n], times[n] is the tick of TimeThread when it was read and errors[n]
+is the number of failed readings since the last good one.
+"""
+
+from array import array
+from timethread import ticks_diff, TICKS_MAX
+
+# Phases of a group of sensors
+IDLE = 0
+WAIT = 1
+READ = 2
+
+class SamplerGroup(object):
+    """
+    The sensors of one driver on one bus and the phase of their sampling.
+    """
+    def __init__(self, driver, thermometers):
+        self.driver = driver
+        self.ow = driver.ow
+        self.thermometers = thermometers
+        self.sensors = []
+        self.phase = IDLE
+        self.pos = 0
+
+class Sampler(object):
+    """
+    The sampler. Every tick milliseconds it makes one step, which makes at
+    most budget operations on the buses. One operation is the start of a
+    conversion (about 2 ms at standard speed), a full reading of DS18B20
+    (about 10 ms, 6 ms in the fast mode) or a reading of HomeSensor (about
+    7 ms). The check of the end of the conversion is not counted, it takes
+    one time slot. The tick should be longer than the budget takes, so the
+    other tasks of the thread get their time.
+    """
+    def __init__(self, thread, tick = 25, budget = 1):
+        self.thread = thread
+        self.tick = tick
+        self.budget = budget
+        self.task = None
+        self.groups = []
+        self.next_group = 0
+        # The table of the last values
+        self.roms = []
+        self.index = {}
+        self.values = array('i')
+        self.times = array('i')
+        self.errors = bytearray(0)
+        self.read = bytearray(0)
+        # Interval, next time of sampling and the flag of the current round
+        self.intervals = array('i')
+        self.due = array('i')
+        self.wanted = bytearray(0)
+
+    def add_ds18b20(self, ds, interval = 1000, roms = None):
+        """
+        Add the thermometers of the driver, all found thermometers of its bus
+        if the ROMs are not given.
+        """
+
+        if roms is None:
+            roms = ds.ow.dev_list(0x28)
+        return self._add(ds, True, roms, interval)
+
+    def add_home_sensor(self, hs, interval = 1000, roms = None):
+        """
+        Add the devices of the HomeSensor driver, all found devices of its
+        bus if the ROMs are not given.
+        """
+
+        if roms is None:
+            roms = hs.ow.dev_list(0xF0)
+        return self._add(hs, False, roms, interval)
+
+    def _add(self, driver, thermometers, roms, interval):
+        # Adds the sensors to the group of the driver and to the table.
+
+        group = None
+        for g in self.groups:
+            if g.driver is driver:
+                group = g
+        if group is None:
+            group = SamplerGroup(driver, thermometers)
+            self.groups.append(group)
+        now = self.thread.ticks
+        for rom in roms:
+            key = bytes(rom)
+            if key in self.index:
+                continue
+            n = len(self.roms)
+            self.index[key] = n
+            self.roms.append(rom)
+            self.values.append(0)
+            self.times.append(0)
+            self.errors.append(0)
+            self.read.append(0)
+            self.intervals.append(interval)
+            self.due.append(now)
+            self.wanted.append(0)
+            group.sensors.append(n)
+        return len(group.sensors)
+
+    def set_interval(self, rom, interval):
+        """
+        Change the interval of sampling of the sensor.
+        """
+
+        self.intervals[self.index[bytes(rom)]] = interval
+
+    def get(self, rom):
+        """
+        The last value of the sensor, or None if it was never read.
+        """
+
+        n = self.index.get(bytes(rom))
+        if n is None or not self.read[n]:
+            return None
+        return self.values[n]
+
+    def age(self, rom):
+        """
+        Milliseconds since the last good reading of the sensor, or None.
+        """
+
+        n = self.index.get(bytes(rom))
+        if n is None or not self.read[n]:
+            return None
+        return ticks_diff(self.thread.ticks, self.times[n])
+
+    def start(self):
+        """
+        Queue the steps of the sampler in the thread.
+        """
+
+        if self.task is None or not self.task.pending():
+            self.task = self.thread.set_interval(self.tick, self.step)
+        return self.task
+
+    def stop(self):
+        """
+        Stop the sampling. The table keeps the last values.
+        """
+
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def step(self):
+        """
+        One step of the sampling. The groups are passed in turn from the one
+        that was not finished by the previous step, until the budget is
+        spent.
+        """
+
+        groups = self.groups
+        count = len(groups)
+        if not count:
+            return
+        budget = self.budget
+        start = self.next_group % count
+        for i in range(count):
+            n = (start + i) % count
+            budget = self._step_group(groups[n], budget)
+            if budget <= 0:
+                self.next_group = n
+                return
+        self.next_group = start
+
+    def _busy(self, group):
+        # True if another group converts on the same bus with parasite power,
+        # then the bus must stay quiet.
+
+        for g in self.groups:
+            if g is not group and g.ow is group.ow and g.phase == WAIT and \
+                    not g.driver.powered:
+                return True
+        return False
+
+    def _step_group(self, group, budget):
+        # Makes the work of the phase of the group. Returns the rest of the
+        # budget.
+
+        if group.phase == IDLE:
+            if self._busy(group) or not self._take_due(group):
+                return budget
+            if not group.thermometers:
+                group.phase = READ
+                group.pos = 0
+            elif group.driver.start_measure():
+                group.phase = WAIT
+                return budget - 1
+            else:
+                self._fail_wanted(group)
+                return budget - 1
+        if group.phase == WAIT:
+            if not group.driver.is_ready():
+                return budget
+            group.phase = READ
+            group.pos = 0
+        sensors = group.sensors
+        wanted = self.wanted
+        while group.pos < len(sensors):
+            if budget <= 0:
+                return budget
+            n = sensors[group.pos]
+            group.pos += 1
+            if wanted[n]:
+                wanted[n] = 0
+                self._read(group, n)
+                budget -= 1
+        group.phase = IDLE
+        return budget
+
+    def _take_due(self, group):
+        # Marks the sensors of the group whose time has come. Returns True if
+        # there are such sensors.
+
+        now = self.thread.ticks
+        due = self.due
+        intervals = self.intervals
+        wanted = self.wanted
+        found = False
+        for n in group.sensors:
+            if ticks_diff(now, due[n]) >= 0:
+                wanted[n] = 1
+                found = True
+                # The next time is counted from the planned one, but a long
+                # delay is not caught up
+                d = (due[n] + intervals[n]) & TICKS_MAX
+                if ticks_diff(d, now) <= 0:
+                    d = (now + intervals[n]) & TICKS_MAX
+                due[n] = d
+        return found
+
+    def _fail_wanted(self, group):
+        # No device answered the conversion, the marked sensors failed.
+
+        wanted = self.wanted
+        errors = self.errors
+        for n in group.sensors:
+            if wanted[n]:
+                wanted[n] = 0
+                if errors[n] < 255:
+                    errors[n] += 1
+
+    def _read(self, group, n):
+        # Reads the sensor into the table.
+
+        rom = self.roms[n]
+        if group.thermometers:
+            value = group.driver.get_temp16(rom)
+        else:
+            value = group.driver.get_data(rom)
+            if value is False:
+                value = None
+        if value is None:
+            if self.errors[n] < 255:
+                self.errors[n] += 1
+            return
+        self.values[n] = value
+        self.times[n] = self.thread.ticks
+        self.errors[n] = 0
+        self.read[n] = 1
@@ -0,0 +1,368 @@
+"""
+Simulated 1-Wire bus to run the drivers on a desktop computer.
+Copyright (c) 2015, Moklyak Alexandr.
+
+SimBus is the bus with virtual devices. It can be connected in two ways:
+    - install() puts the stand-in of the pyb module into sys.modules. Its Pin
+      watches the level of the pin and its udelay() moves the simulated time,
+      so OneWire with PinBus works on the bus without changes;
+    - LoopbackUart(bus) from loopback.py gives the bus to UartBus.
+>>> from simbus import SimBus, SimDS18B20, SimHomeSensor, install
+>>> bus = SimBus([SimDS18B20(temp=21.5), SimDS18B20(temp=-3), SimHomeSensor(value=7)])
+>>> install(bus)
+>>> from onewire import OneWire
+>>> from ds18b20 import DS18B20
+>>> ow = OneWire('X4')
+>>> ds = DS18B20(ow)
+>>> roms = ds.ow.search()
+
+Devices answer the ROM commands (search, alarm search, match, skip, read ROM)
+and their own function commands. SimDS18B20 keeps the scratchpad, takes the
+conversion time of its resolution and can damage the data with the given
+probability to check the CRC handling. The simulated time in microseconds is
+kept in bus.time.us, so the time of the bus operations can be measured.
+Overdrive is not supported by the virtual devices.
+"""
+
+import sys
+import types
+import random
+
+from onewire import crc8
+
+class SimTime(object):
+    """
+    Simulated time in microseconds. Any object with the attribute us and the
+    method advance() can be used instead, for example VirtualClock of
+    TimeThread, then the ticks of the thread go on while the bus works.
+    """
+    def __init__(self):
+        self.us = 0
+
+    def advance(self, us):
+        self.us += us
+
+def make_rom(family):
+    """
+    Returns a random ROM of the family with the correct CRC.
+    """
+    rom = bytearray(8)
+    rom[0] = family
+    for i in range(1, 7):
+        rom[i] = random.randrange(256)
+    rom[7] = crc8(rom[:7])
+    return bytes(rom)
+
+class SimDevice(object):
+    """
+    The virtual device. It answers the ROM commands, the function commands
+    are answered by function() of subclasses.
+    The session of the device is a generator which yields the level that the
+    device puts on the bus in the next time slot (1 if it does not pull the
+    bus down) and receives the level of the bus in this slot.
+    """
+    FAMILY = 0x00
+
+    def __init__(self, rom = None):
+        if rom is None:
+            rom = make_rom(self.FAMILY)
+        self.rom = bytes(rom)
+        self.bus = None
+        self.alarm = False
+        self.session = None
+        self.out = 1
+
+    def start(self):
+        # Called by the reset pulse.
+        self.session = self._session()
+        self.out = next(self.session)
+
+    def slot(self, level):
+        # Called at the end of every time slot.
+        if self.session is None:
+            return
+        try:
+            self.out = self.session.send(level)
+        except StopIteration:
+            self.session = None
+            self.out = 1
+
+    def _read_byte(self):
+        value = 0
+        for i in range(8):
+            level = yield 1
+            value |= level << i
+        return value
+
+    def _write_byte(self, value):
+        for i in range(8):
+            yield (value >> i) & 1
+
+    def _rom_bits(self):
+        for byte in self.rom:
+            for i in range(8):
+                yield (byte >> i) & 1
+
+    def _session(self):
+        cmd = yield from self._read_byte()
+        if cmd == 0xf0 or (cmd == 0xec and self.alarm):
+            for bit in self._rom_bits():
+                yield bit
+                yield bit ^ 1
+                level = yield 1
+                if level != bit:
+                    return
+            return
+        elif cmd == 0x55:
+            for bit in self._rom_bits():
+                level = yield 1
+                if level != bit:
+                    return
+        elif cmd == 0x33:
+            for byte in self.rom:
+                yield from self._write_byte(byte)
+        elif cmd != 0xcc:
+            return
+        yield from self.function()
+
+    def function(self):
+        # The function commands of the device.
+        return
+        yield
+
+class SimDS18B20(SimDevice):
+    """
+    Virtual DS18B20 thermometer. The temperature is in degrees, the error
+    rate is the probability that a read of the scratchpad is damaged.
+    """
+    FAMILY = 0x28
+
+    def __init__(self, rom = None, temp = 25.0, resolution = 12, powered = True,
+                 error_rate = 0):
+        SimDevice.__init__(self, rom)
+        self.temp = temp
+        self.powered = powered
+        self.error_rate = error_rate
+        self.th = 75
+        self.tl = 70
+        self.config = ((resolution - 9) << 5) | 0x1f
+        self.eeprom = (self.th, self.tl, self.config)
+        # Temperature of the last conversion, 85 degrees after power on
+        self.raw = 85 * 16
+        self.ready_at = 0
+
+    def conversion_time(self):
+        # Microseconds of the conversion at the current resolution.
+        return 93750 << ((self.config >> 5) & 3)
+
+    def scratchpad(self):
+        data = bytearray(9)
+        raw = self.raw & 0xffff
+        data[0] = raw & 0xff
+        data[1] = raw >> 8
+        data[2] = self.th
+        data[3] = self.tl
+        data[4] = self.config
+        data[5] = 0xff
+        data[6] = 0x0c
+        data[7] = 0x10
+        data[8] = crc8(data[:8])
+        if self.error_rate and random.random() < self.error_rate:
+            data[random.randrange(9)] ^= 1 << random.randrange(8)
+        return data
+
+    def function(self):
+        cmd = yield from self._read_byte()
+        now = self.bus.time.us
+        if cmd == 0x44:
+            # Bits below the resolution are not measured
+            lost = 3 - ((self.config >> 5) & 3)
+            self.raw = (int(round(self.temp * 16)) >> lost) << lost
+            self.ready_at = now + self.conversion_time()
+            while True:
+                yield 1 if self.bus.time.us >= self.ready_at else 0
+        elif cmd == 0xbe:
+            for byte in self.scratchpad():
+                yield from self._write_byte(byte)
+        elif cmd == 0x4e:
+            self.th = yield from self._read_byte()
+            self.tl = yield from self._read_byte()
+            self.config = (yield from self._read_byte()) & 0x60 | 0x1f
+        elif cmd == 0x48:
+            self.eeprom = (self.th, self.tl, self.config)
+        elif cmd == 0xb8:
+            self.th, self.tl, self.config = self.eeprom
+        elif cmd == 0xb4:
+            while True:
+                yield 1 if self.powered else 0
+
+class SimHomeSensor(SimDevice):
+    """
+    Virtual HomeSensor with one byte value. The values are the bytes of the
+    frame, by default the frame holds the value only.
+    """
+    FAMILY = 0xf0
+
+    def __init__(self, rom = None, value = 0, values = None):
+        SimDevice.__init__(self, rom)
+        self.value = value
+        self.values = values
+
+    def function(self):
+        cmd = yield from self._read_byte()
+        if cmd == 0xa0:
+            data = bytearray(2)
+            data[0] = self.value & 0xff
+            data[1] = crc8(data[:1])
+        elif cmd == 0xa1:
+            values = self.values
+            if values is None:
+                values = (self.value,)
+            data = bytearray(len(values) + 2)
+            data[0] = len(values)
+            for i in range(len(values)):
+                data[i + 1] = values[i] & 0xff
+            data[-1] = crc8(data[:-1])
+        else:
+            return
+        for byte in data:
+            yield from self._write_byte(byte)
+
+class SimBus(object):
+    """
+    The virtual bus. The level of the bus is the wired AND of the master and
+    all devices.
+    """
+    def __init__(self, devices = (), time = None):
+        self.time = time or SimTime()
+        self.devices = []
+        # Interval of time when the devices hold the bus down
+        self.low_from = 0
+        self.low_until = 0
+        for device in devices:
+            self.add(device)
+
+    def add(self, device):
+        device.bus = self
+        self.devices.append(device)
+        return device
+
+    def remove(self, device):
+        self.devices.remove(device)
+        device.bus = None
+
+    def advance(self, us):
+        self.time.advance(us)
+
+    def reset(self):
+        """
+        The reset pulse. Returns True if any device answers.
+        """
+        for device in self.devices:
+            device.start()
+        return len(self.devices) > 0
+
+    def slot(self, bit):
+        """
+        The time slot in which the master writes the bit (1 for reading).
+        Returns the level of the bus.
+        """
+        level = bit
+        for device in self.devices:
+            level &= device.out
+        for device in self.devices:
+            device.slot(level)
+        return level
+
+    def release(self, duration):
+        # The master released the bus after it held it down for the duration.
+        now = self.time.us
+        if duration >= 240:
+            if self.reset():
+                self.low_from = now + 15
+                self.low_until = now + 240
+        elif duration < 15:
+            if not self.slot(1):
+                self.low_from = now - duration
+                self.low_until = now - duration + 30
+        else:
+            self.slot(0)
+
+    def pulled(self):
+        # True if a device holds the bus down now.
+        return self.low_from <= self.time.us < self.low_until
+
+class SimPin(object):
+    """
+    The stand-in of pyb.Pin connected to the simulated bus.
+    """
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 2
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    # Buses of the pins by names and the bus for any other pin
+    buses = {}
+    bus = None
+
+    def __init__(self, pinId, mode = IN, pull = PULL_NONE):
+        self.id = pinId
+        self.bus = SimPin.buses.get(pinId, SimPin.bus)
+        self.mode = mode
+        self.latch = 1
+        self.low = False
+        self.low_start = 0
+
+    def init(self, mode, pull = PULL_NONE):
+        self.mode = mode
+        self._update()
+
+    def value(self, v = None):
+        if v is None:
+            if self.low or (self.bus and self.bus.pulled()):
+                return 0
+            return 1
+        self.latch = 1 if v else 0
+        self._update()
+
+    def _update(self):
+        low = self.mode != self.IN and self.latch == 0
+        if self.bus:
+            now = self.bus.time.us
+            if low and not self.low:
+                self.low_start = now
+            elif self.low and not low:
+                self.bus.release(now - self.low_start)
+        self.low = low
+
+def install(bus, pins = None):
+    """
+    Puts the stand-in of the pyb module into sys.modules. All pins are
+    connected to the bus, or pins gives the buses by names of pins. The time
+    of the stand-in is the time of the bus.
+    """
+    time = bus.time
+    SimPin.bus = bus
+    SimPin.buses = pins or {}
+
+    pyb = types.ModuleType('pyb')
+    pyb.Pin = SimPin
+
+    def udelay(us):
+        time.advance(us)
+
+    def delay(ms):
+        time.advance(ms * 1000)
+
+    pyb.udelay = udelay
+    pyb.delay = delay
+    pyb.micros = lambda: time.us
+    pyb.millis = lambda: time.us // 1000
+    pyb.elapsed_micros = lambda start: time.us - start
+    pyb.elapsed_millis = lambda start: time.us // 1000 - start
+    pyb.disable_irq = lambda: True
+    pyb.enable_irq = lambda state = True: None
+    pyb.wfi = lambda: None
+    sys.modules['pyb'] = pyb
+    return pyb
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+"""
+The utility to benchmark the 1-Wire drivers on a desktop computer.
+Copyright (c) 2015, Moklyak Alexandr.
+
+The drivers are run on SimBus from simbus.py. For every count of devices the
+utility prints the time of the bus search and the number of temperature reads
+per second. The time of the bus is simulated: it is the sum of all delays of
+the time slots, the time of the Python code on the board is not included.
+The time of the host is given to compare the load of the drivers code.
+
+Usage:
+    owbench.py [--devices 1,10,40] [--transport pin|uart] [--errors 0.01]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from simbus import SimBus, SimDS18B20, SimHomeSensor, install
+
+def bench(count, transport, errors, reads, seed):
+    random.seed(seed)
+    bus = SimBus()
+    for i in range(count):
+        if i % 4 == 3:
+            bus.add(SimHomeSensor(value=i))
+        else:
+            bus.add(SimDS18B20(temp=random.uniform(-20, 40),
+                               error_rate=errors))
+    pyb = install(bus)
+
+    from onewire import OneWire, UartBus
+    from loopback import LoopbackUart
+    from ds18b20 import DS18B20
+
+    if transport == 'uart':
+        ow = OneWire(UartBus(LoopbackUart(bus)))
+    else:
+        ow = OneWire('X4')
+    ds = DS18B20(ow)
+
+    start_us = bus.time.us
+    start = time.perf_counter()
+    roms = ow.search()
+    search_us = bus.time.us - start_us
+    search_wall = time.perf_counter() - start
+
+    ds.start_measure()
+    pyb.delay(750)
+    thermometers = ow.dev_list(0x28)
+    done = 0
+    failed = 0
+    start_us = bus.time.us
+    start = time.perf_counter()
+    for i in range(reads):
+        for rom in thermometers:
+            if ds.get_temp(rom) is False:
+                failed += 1
+            done += 1
+    read_us = bus.time.us - start_us
+    read_wall = time.perf_counter() - start
+    return (len(roms), search_us / 1000, search_wall * 1000,
+            done * 1000000 / max(read_us, 1), done / max(read_wall, 1e-9),
+            failed)
+
+def main():
+    parser = argparse.ArgumentParser(description='1-Wire drivers benchmark')
+    parser.add_argument('--devices', default='1,10,40',
+                        help='comma separated counts of devices')
+    parser.add_argument('--transport', choices=('pin', 'uart'), default='pin')
+    parser.add_argument('--errors', type=float, default=0,
+                        help='probability of a damaged scratchpad read')
+    parser.add_argument('--reads', type=int, default=5,
+                        help='reads of every thermometer')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print('%8s %8s %12s %12s %10s %12s %7s' % ('devices', 'found',
+          'search bus', 'search host', 'reads/s', 'host reads/s', 'failed'))
+    for n in args.devices.split(','):
+        found, search_ms, search_wall, rate, wall_rate, failed = bench(
+            int(n), args.transport, args.errors, args.reads, args.seed)
+        print('%8d %8d %10.1fms %10.1fms %10.1f %12.1f %7d' % (int(n), found,
+              search_ms, search_wall, rate, wall_rate, failed))
+
+if __name__ == '__main__':
+    main()
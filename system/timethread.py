@@ -20,9 +20,242 @@ be anything. Also, in each call individual time interval can be set.
 The only limitation is function pointer should be unique. The method
 set_time_out() is the pointer for uniqueness and if pointer is not unique
 then nothing is added.
+
+Every queued function is represented by a Task object. It is returned by
+set_time_out(), set_interval() and schedule() and allows to cancel or move
+the call later. A periodic task does not need to queue itself again:
+>>> from pyb import LED
+>>> from timethread import TimeThread
+>>> th = TimeThread(1)
+>>> blink = th.set_interval(500, LED(3).toggle)
+>>> th.set_time_out(10000, blink.cancel)
+>>> th.run()
+The next call of a periodic task is counted from the previous deadline and
+not from the moment of the call, so the interval does not drift.
+
+The queue is ordered by absolute deadlines. The hardware timer only advances
+a millisecond tick counter, so the cost of the interrupt does not depend on
+the number of queued functions. The nearest deadline is always on top of a
+binary heap and adding or taking an entry costs O(log n).
+
+While the nearest deadline is not reached the main loop sleeps in pyb.wfi()
+and is woken by the next interrupt. When the queue is empty the hardware timer
+is stopped and it is started again by the next call of set_time_out().
+
+If the thread is created with stats=True then it measures how late every
+function is called, how long it runs, how many periods are missed and which
+exceptions it raises. The figures are kept per function and the counting
+does not allocate memory:
+>>> th = TimeThread(1, stats=True)
+>>> ...
+>>> s = th.get_stats(func)
+>>> print(s.late_max, s.late_avg(), s.run_max, s.errors, s.last_error)
+>>> print(th.load())
+
+Instead of a function a generator or a coroutine can be queued. It runs
+until it yields the number of milliseconds to wait (or awaits sleep_ms()),
+other functions are called meanwhile and then it is resumed from the same
+place. A long operation with the device is written as a simple loop:
+>>> from timethread import TimeThread, sleep_ms
+>>> th = TimeThread(1)
+>>> def measure():
+>>>     while True:
+>>>         ds.start_measure()
+>>>         yield 750
+>>>         temps = [ds.get_temp(rom) for rom in roms]
+>>>         yield 10000
+>>> th.schedule(0, measure())
+The same with a coroutine:
+>>> async def measure():
+>>>     while True:
+>>>         ds.start_measure()
+>>>         await sleep_ms(750)
+>>>         temps = [ds.get_temp(rom) for rom in roms]
+>>>         await sleep_ms(10000)
+>>> th.schedule(0, measure())
+
+Interrupt handlers can not call set_time_out() because it allocates memory.
+Instead they post events: a number of event and an integer argument are
+written to a ring buffer allocated in advance. The main loop wakes up at once
+and calls the handler registered for the event:
+>>> from pyb import ExtInt, Pin
+>>> BUTTON = 1
+>>> def on_button(line):
+>>>     LED(3).toggle()
+>>> th.on_event(BUTTON, on_button)
+>>> ExtInt('X5', ExtInt.IRQ_FALLING, Pin.PULL_UP, th.irq_handler(BUTTON))
+
+The time source is the clock object. By default it is TimerClock, which uses
+the hardware timer and the pyb module. Any object with the same methods can
+be given instead, for example VirtualClock from virtualclock.py runs the
+scheduler on a desktop computer in simulated time:
+>>> from virtualclock import VirtualClock
+>>> clock = VirtualClock()
+>>> th = TimeThread(clock=clock)
+>>> th.set_interval(100, func)
+>>> th.set_time_out(60000, th.stop)
+>>> th.run()
 """
 
-from pyb import Timer
+from array import array
+
+# The tick counter is kept modulo TICKS_PERIOD. It always stays a small
+# integer, so incrementing it in the interrupt never allocates memory.
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD >> 1
+
+def ticks_diff(a, b):
+    """
+    Returns the signed difference a - b of two tick values. The result is
+    correct while the values are less than TICKS_HALF apart.
+    """
+    return ((a - b + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+# Averages are taken over the last calls. When the counter of calls reaches
+# this value the sums are halved, so they never leave the small integers.
+STATS_WINDOW = 256
+
+class TimerClock(object):
+    """
+    The time source of TimeThread on the pyboard. The hardware timer gives
+    the millisecond ticks, the rest is taken from the pyb module.
+    """
+    def __init__(self, timerNum):
+        import pyb
+        self.timer = pyb.Timer(timerNum)
+        self.idle = pyb.wfi
+        self.disable_irq = pyb.disable_irq
+        self.enable_irq = pyb.enable_irq
+        self.micros = pyb.micros
+        self.millis = pyb.millis
+        self.elapsed_micros = pyb.elapsed_micros
+        self.elapsed_millis = pyb.elapsed_millis
+
+    def start(self, handler):
+        """
+        Starts calling the handler 1000 times per second.
+        """
+        self.timer.init(freq=1000)
+        self.timer.callback(handler)
+
+    def stop(self):
+        """
+        Stops the ticks.
+        """
+        self.timer.deinit()
+
+class sleep_ms(object):
+    """
+    The awaitable pause for coroutines queued in TimeThread.
+    """
+    def __init__(self, ms):
+        self.ms = ms
+
+    def __iter__(self):
+        yield self.ms
+
+    __await__ = __iter__
+
+class TaskStats(object):
+    """
+    Statistics of the calls of one function. Lateness is counted in
+    milliseconds from the deadline, run time in microseconds.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all figures.
+        """
+        self.calls = 0
+        self.late_min = 0
+        self.late_max = 0
+        self.run_min = 0
+        self.run_max = 0
+        self.overruns = 0
+        self.errors = 0
+        self.last_error = None
+        # Sums for the averages and the number of summed calls
+        self.late_sum = 0
+        self.run_sum = 0
+        self.count = 0
+
+    def late_avg(self):
+        """
+        Average lateness of the last calls in milliseconds.
+        """
+        return self.late_sum // self.count if self.count else 0
+
+    def run_avg(self):
+        """
+        Average run time of the last calls in microseconds.
+        """
+        return self.run_sum // self.count if self.count else 0
+
+    def _add(self, late, run):
+        if self.calls == 0 or late < self.late_min:
+            self.late_min = late
+        if late > self.late_max:
+            self.late_max = late
+        if self.calls == 0 or run < self.run_min:
+            self.run_min = run
+        if run > self.run_max:
+            self.run_max = run
+        self.calls += 1
+        if self.count == STATS_WINDOW:
+            self.count >>= 1
+            self.late_sum >>= 1
+            self.run_sum >>= 1
+        self.count += 1
+        self.late_sum += late
+        self.run_sum += run
+
+class Task(object):
+    """
+    The handle of a function queued in TimeThread. The task knows its place
+    in the queue, so it is cancelled or moved without search.
+    """
+    def __init__(self, thread, function, period = 0, stats = None):
+        self.thread = thread
+        self.function = function
+        self.period = period
+        self.stats = stats
+        # Generators and coroutines are resumed instead of called
+        self.coro = not callable(function)
+        self.deadline = 0
+        self.seq = 0
+        # Position in the heap of the thread or -1 if the task is not queued
+        self.index = -1
+        # The task of set_time_out(), it keeps the function unique
+        self.unique = False
+
+    def pending(self):
+        """
+        Returns True while the task waits in the queue.
+        """
+        return self.index >= 0
+
+    def cancel(self):
+        """
+        Removes the task from the queue. Nothing happens if the task is not
+        queued.
+        """
+        self.thread._remove(self)
+
+    def reschedule(self, delay, period = None):
+        """
+        Moves the next call of the task to delay milliseconds from now. The
+        task is queued again if it was already called or cancelled. If period
+        is set then it replaces the interval of the task, 0 makes the task
+        one-shot.
+        """
+        if period is not None:
+            self.period = period
+        thread = self.thread
+        thread._remove(self)
+        thread._queue(self, (thread.ticks + delay) & TICKS_MAX)
 
 class TimeThread(object):
     """
@@ -30,10 +263,34 @@ class TimeThread(object):
     intervals. For synchronization a hardware timer is used. The class contains
     main loop to check flags of queue.
     """
-    def __init__(self, timerNum):
+    def __init__(self, timerNum = None, stats = False, events = 16,
+                 clock = None):
+        self.ticks = 0
+        # Min-heap of queued tasks ordered by deadline
         self.timerQueue = []
-        self.timer = Timer(timerNum, freq=1000)
-        self.timer.callback(self._timer_handler)
+        # Tasks added by set_time_out(), for the check of uniqueness
+        self.pending = {}
+        self.seq = 0
+        if clock is None:
+            clock = TimerClock(timerNum)
+        self.clock = clock
+        self.timer_on = False
+        self.running = False
+        # Statistics of functions, None if the counting is off
+        self.task_stats = {} if stats else None
+        self.reset_load()
+        # Ring buffer of events posted from interrupts. One cell is always
+        # kept free to tell the full buffer from the empty one.
+        self.ev_size = events + 1
+        self.ev_ids = array('i', [0] * self.ev_size)
+        self.ev_args = array('i', [0] * self.ev_size)
+        self.ev_head = 0
+        self.ev_tail = 0
+        self.ev_lost = 0
+        # Exceptions raised by the handlers of events
+        self.ev_errors = 0
+        self.ev_last_error = None
+        self.ev_handlers = {}
 
     """
     The method adds a pointer of function and delay time to the event queue.
@@ -42,36 +299,346 @@ class TimeThread(object):
     If such a pointer already added to an event queue then it is not added again.
     When the queue comes to this pointer then entry is removed from the queue.
     But the pointer function is run.
+    The result is the task of the function.
     """
     def set_time_out(self, delay, function):
-        b = True
-        for r in self.timerQueue:
-            if r[1] == function:
-                b = False
-        if b:
-            self.timerQueue += [[delay, function]]        
+        task = self.pending.get(function)
+        if task is None:
+            task = self.schedule(delay, function)
+            task.unique = True
+            self.pending[function] = task
+        return task
+
+    """
+    The method queues the function to be called every period milliseconds.
+    The first call is made after delay milliseconds, by default after one
+    period. The result is the task of the function.
+    """
+    def set_interval(self, period, function, delay = None):
+        if delay is None:
+            delay = period
+        return self.schedule(delay, function, period)
+
+    """
+    The method queues a new task without the check of uniqueness. The function
+    is called after delay milliseconds and then every period milliseconds if
+    the period is not 0.
+    If a generator or a coroutine is given instead of the function then it is
+    resumed after delay milliseconds and then every time after the pause it
+    yields. The period is not used for them.
+    """
+    def schedule(self, delay, function, period = 0):
+        stats = None
+        if self.task_stats is not None:
+            stats = self.task_stats.get(function)
+            if stats is None:
+                stats = TaskStats()
+                self.task_stats[function] = stats
+        task = Task(self, function, period, stats)
+        self._queue(task, (self.ticks + delay) & TICKS_MAX)
+        return task
+
+    """
+    The method returns the statistics of the function or None if the thread
+    counts no statistics or the function was never queued.
+    """
+    def get_stats(self, function):
+        if self.task_stats is None:
+            return None
+        return self.task_stats.get(function)
+
+    """
+    The method returns the share of time in percents that the functions took
+    since the previous call of load() or reset_load(). The share is counted
+    only if the thread is created with stats=True.
+    """
+    def load(self):
+        busy = self.busy_ms * 1000 + self.busy_us
+        total = self.clock.elapsed_millis(self.load_start) * 1000
+        self.reset_load()
+        if total <= 0:
+            return 0
+        return min(100, busy * 100 // total)
+
+    def reset_load(self):
+        self.load_start = self.clock.millis()
+        self.busy_ms = 0
+        self.busy_us = 0
+
+    """
+    The method registers the handler of the event. The handler is called from
+    the main loop with the argument of the event. None removes the handler.
+    Exceptions of the handlers are counted in ev_errors and the last one is
+    kept in ev_last_error. With stats=True the handler also has its own
+    statistics like a queued function, lateness is not counted for it.
+    """
+    def on_event(self, event, handler):
+        if handler is None:
+            self.ev_handlers.pop(event, None)
+        else:
+            self.ev_handlers[event] = handler
+            stats = self.task_stats
+            if stats is not None and handler not in stats:
+                stats[handler] = TaskStats()
+
+    """
+    The method puts the event into the ring buffer. It can be called from an
+    interrupt handler and does not allocate memory. The event and the argument
+    should be integers. If the buffer is full the event is lost and counted
+    in ev_lost.
+    """
+    def post(self, event, arg = 0):
+        clock = self.clock
+        i = clock.disable_irq()
+        head = self.ev_head
+        n = head + 1
+        if n == self.ev_size:
+            n = 0
+        if n == self.ev_tail:
+            self.ev_lost += 1
+        else:
+            self.ev_ids[head] = event
+            self.ev_args[head] = arg
+            self.ev_head = n
+        clock.enable_irq(i)
+
+    """
+    The method returns the function which posts the event when it is called
+    from an interrupt. The argument of the interrupt (the line of ExtInt) is
+    passed with the event, any other object is replaced by 0.
+    """
+    def irq_handler(self, event):
+        post = self.post
+        def handler(arg):
+            if type(arg) is not int:
+                arg = 0
+            post(event, arg)
+        return handler
+
+    def _dispatch_events(self):
+        # Calls the handlers of all posted events.
+        handlers = self.ev_handlers
+        while self.ev_tail != self.ev_head:
+            tail = self.ev_tail
+            event = self.ev_ids[tail]
+            arg = self.ev_args[tail]
+            tail += 1
+            if tail == self.ev_size:
+                tail = 0
+            self.ev_tail = tail
+            handler = handlers.get(event)
+            if handler is None:
+                continue
+            stats = None
+            if self.task_stats is not None:
+                stats = self.task_stats.get(handler)
+            if stats is None:
+                try:
+                    handler(arg)
+                except Exception as e:
+                    self.ev_errors += 1
+                    self.ev_last_error = e
+                continue
+            clock = self.clock
+            start = clock.micros()
+            try:
+                handler(arg)
+            except Exception as e:
+                self.ev_errors += 1
+                self.ev_last_error = e
+                stats.errors += 1
+                stats.last_error = e
+            run = clock.elapsed_micros(start)
+            stats._add(0, run)
+            self._add_busy(run)
+
+    def _queue(self, task, deadline):
+        # The task of set_time_out() keeps its function unique every time
+        # it is queued again.
+        if task.unique and task.function not in self.pending:
+            self.pending[task.function] = task
+        task.deadline = deadline
+        task.seq = self.seq
+        self.seq = (self.seq + 1) & TICKS_MAX
+        self._push(task)
+        if not self.timer_on:
+            self._start_timer()
+
+    def _remove(self, task):
+        # Takes the task out of the heap from any position.
+        i = task.index
+        if i < 0:
+            return
+        self._forget(task)
+        q = self.timerQueue
+        last = q.pop()
+        if i < len(q):
+            q[i] = last
+            last.index = i
+            self._sift_down(i)
+            self._sift_up(last.index)
+
+    def _forget(self, task):
+        task.index = -1
+        if self.pending.get(task.function) is task:
+            del self.pending[task.function]
+
+    def _start_timer(self):
+        # Starts the tick counter. The ticks are used only to compare queued
+        # deadlines, so a pause while the queue is empty does not matter.
+        self.clock.start(self._timer_handler)
+        self.timer_on = True
+
+    def _stop_timer(self):
+        self.clock.stop()
+        self.timer_on = False
 
     # The handler of hardware timer
     def _timer_handler(self, timer):
+        self.ticks = (self.ticks + 1) & TICKS_MAX
+
+    def _before(self, a, b):
+        # Tasks with equal deadlines are taken in order of addition.
+        d = ticks_diff(a.deadline, b.deadline)
+        return d < 0 or (d == 0 and ticks_diff(a.seq, b.seq) < 0)
+
+    def _push(self, task):
+        q = self.timerQueue
+        task.index = len(q)
+        q.append(task)
+        self._sift_up(task.index)
+
+    def _sift_up(self, i):
         q = self.timerQueue
-        for i in range(len(q)):
-            if q[i][0] > 0:
-                q[i][0] -= 1
+        task = q[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not self._before(task, q[parent]):
+                break
+            q[i] = q[parent]
+            q[i].index = i
+            i = parent
+        q[i] = task
+        task.index = i
+
+    def _sift_down(self, i):
+        q = self.timerQueue
+        n = len(q)
+        task = q[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._before(q[child + 1], q[child]):
+                child += 1
+            if not self._before(q[child], task):
+                break
+            q[i] = q[child]
+            q[i].index = i
+            i = child
+        q[i] = task
+        task.index = i
+
+    def _pop(self):
+        # Takes the task with the nearest deadline from the heap.
+        q = self.timerQueue
+        top = q[0]
+        last = q.pop()
+        if q:
+            q[0] = last
+            self._sift_down(0)
+        self._forget(top)
+        return top
+
+    def _dispatch(self, task):
+        # Periodic task is queued again before the call, so the function can
+        # cancel or reschedule its own task. Missed periods are skipped.
+        stats = task.stats
+        late = ticks_diff(self.ticks, task.deadline)
+        period = task.period
+        # Generators are queued again by _call() for the pause they yield
+        if period and not task.coro:
+            deadline = (task.deadline + period) & TICKS_MAX
+            missed = ticks_diff(self.ticks, deadline)
+            if missed >= 0:
+                missed = missed // period + 1
+                deadline = (deadline + missed * period) & TICKS_MAX
+                if stats is not None:
+                    stats.overruns += missed
+            self._queue(task, deadline)
+        if stats is None:
+            try:
+                self._call(task)
+            except Exception:
+                pass
+            return
+        clock = self.clock
+        start = clock.micros()
+        try:
+            self._call(task)
+        except Exception as e:
+            stats.errors += 1
+            stats.last_error = e
+        run = clock.elapsed_micros(start)
+        stats._add(late, run)
+        self._add_busy(run)
+
+    def _add_busy(self, run):
+        # Adds the run time in microseconds to the load.
+        self.busy_us += run
+        if self.busy_us >= 1000000:
+            self.busy_us -= 1000000
+            self.busy_ms += 1000
+
+    def _call(self, task):
+        # Calls the function or resumes the generator of the task. The
+        # generator is queued again for the pause it has yielded.
+        if not task.coro:
+            task.function()
+            return
+        try:
+            delay = task.function.send(None)
+        except StopIteration:
+            return
+        # The generator could have rescheduled its task itself
+        if task.index >= 0:
+            return
+        self._queue(task, (self.ticks + (delay or 0)) & TICKS_MAX)
 
     """
-    The method runs an infinite loop in wich the queue is processed. 
-    This method should be accessed after pre-filling queue.    
+    The method runs an infinite loop in wich the queue is processed.
+    This method should be accessed after pre-filling queue.
     Further work is performed within the specified (by the method
     set_time_out()) functions.
+    Between the calls the processor sleeps until the next interrupt.
+    Posted events are handled before the queued functions.
+    The loop ends after the call of stop().
     """
     def run(self):
         q = self.timerQueue
-        while True:            
-            for i in range(len(q) - 1, -1, -1):
-                if q[i][0] == 0:
-                    f = q[i][1]
-                    del(q[i])
-                    try:
-                        f()
-                    except:
-                        pass
+        clock = self.clock
+        self.running = True
+        while self.running:
+            if self.ev_tail != self.ev_head:
+                self._dispatch_events()
+                if not self.running:
+                    break
+            if q:
+                if ticks_diff(q[0].deadline, self.ticks) <= 0:
+                    self._dispatch(self._pop())
+                    continue
+            elif self.timer_on:
+                self._stop_timer()
+            # Interrupts are disabled between the check and wfi(), so a tick
+            # or an event that comes in between still wakes the processor.
+            i = clock.disable_irq()
+            if self.ev_tail == self.ev_head and (not q or
+                    ticks_diff(q[0].deadline, self.ticks) > 0):
+                clock.idle()
+            clock.enable_irq(i)
+
+    """
+    The method makes run() return after the current function.
+    """
+    def stop(self):
+        self.running = False
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+"""
+The utility to benchmark TimeThread on a desktop computer.
+Copyright (c) 2015, Moklyak Alexandr.
+
+The scheduler is run with VirtualClock. Every task is periodic with a random
+period and takes a fixed simulated time. For every count of tasks the utility
+prints how many calls per second of real time the scheduler makes on this
+computer and how late the calls are in simulated milliseconds.
+
+Usage:
+    timebench.py [--tasks 100,1000,5000] [--seconds 10] [--cost 20]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+
+from timethread import TimeThread
+from virtualclock import VirtualClock
+
+def bench(tasks, seconds, cost, seed):
+    random.seed(seed)
+    clock = VirtualClock()
+    th = TimeThread(clock=clock, stats=True)
+
+    def make_task():
+        def task():
+            clock.advance(cost)
+        return task
+
+    functions = []
+    for i in range(tasks):
+        f = make_task()
+        functions.append(f)
+        period = random.randint(10, 1000)
+        th.set_interval(period, f, random.randint(0, period))
+    th.set_time_out(seconds * 1000, th.stop)
+
+    start = time.perf_counter()
+    th.run()
+    wall = time.perf_counter() - start
+
+    calls = 0
+    late_sum = 0
+    late_max = 0
+    overruns = 0
+    for f in functions:
+        s = th.get_stats(f)
+        calls += s.calls
+        if s.count:
+            late_sum += s.late_sum * s.calls / s.count
+        late_max = max(late_max, s.late_max)
+        overruns += s.overruns
+    return (calls, wall, late_sum / max(calls, 1), late_max, overruns,
+            th.load())
+
+def main():
+    parser = argparse.ArgumentParser(description='TimeThread benchmark')
+    parser.add_argument('--tasks', default='100,1000,5000',
+                        help='comma separated counts of tasks')
+    parser.add_argument('--seconds', type=int, default=10,
+                        help='simulated time of every run')
+    parser.add_argument('--cost', type=int, default=20,
+                        help='simulated run time of a task in microseconds')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print('%8s %10s %12s %10s %10s %9s %6s' % ('tasks', 'calls', 'calls/s',
+          'late avg', 'late max', 'overruns', 'load'))
+    for n in args.tasks.split(','):
+        n = int(n)
+        calls, wall, late_avg, late_max, overruns, load = bench(
+            n, args.seconds, args.cost, args.seed)
+        print('%8d %10d %12d %8.2fms %8dms %9d %5d%%' % (n, calls,
+              calls / wall, late_avg, late_max, overruns, load))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Simulated time source for TimeThread.
+Copyright (c) 2015, Moklyak Alexandr.
+
+VirtualClock has the same methods as TimerClock but does not need the pyboard.
+The time stands still until it is moved by advance() or by idle(), which is
+called by TimeThread.run() when there is nothing to do. So the scheduler can
+be run, tested and profiled on a desktop computer and every run gives the
+same result.
+
+The work of a queued function takes no simulated time. To make a function
+"heavy" call advance() from it with the number of microseconds it should take.
+The ticks and the interrupts that come during this time are handled inside
+advance() as the hardware would do it.
+
+External interrupts are simulated by interrupt(), for example a button that is
+pressed in 1.5 seconds:
+>>> from timethread import TimeThread
+>>> from virtualclock import VirtualClock
+>>> clock = VirtualClock()
+>>> th = TimeThread(clock=clock)
+>>> th.on_event(1, on_button)
+>>> clock.interrupt(1500000, th.irq_handler(1), 5)
+>>> th.set_time_out(2000, th.stop)
+>>> th.run()
+"""
+
+import heapq
+
+class VirtualClock(object):
+    """
+    The clock which counts simulated microseconds.
+    """
+    def __init__(self):
+        self.us = 0
+        self.handler = None
+        self.next_tick = 0
+        self.interrupts = []
+        self.seq = 0
+
+    def start(self, handler):
+        """
+        Starts calling the handler every simulated millisecond.
+        """
+        self.handler = handler
+        self.next_tick = self.us + 1000
+
+    def stop(self):
+        """
+        Stops the ticks.
+        """
+        self.handler = None
+
+    def interrupt(self, delay, handler, arg = None):
+        """
+        Calls handler(arg) as an interrupt after delay microseconds.
+        """
+        heapq.heappush(self.interrupts, (self.us + delay, self.seq, handler, arg))
+        self.seq += 1
+
+    def _next_wake(self):
+        # Time of the nearest interrupt or None if nothing is expected.
+        t = None
+        if self.handler is not None:
+            t = self.next_tick
+        if self.interrupts and (t is None or self.interrupts[0][0] < t):
+            t = self.interrupts[0][0]
+        return t
+
+    def advance(self, us):
+        """
+        Moves the time forward and handles all interrupts on the way.
+        """
+        end = self.us + us
+        while True:
+            t = self._next_wake()
+            if t is None or t > end:
+                break
+            self.us = t
+            if self.interrupts and self.interrupts[0][0] == t:
+                handler, arg = heapq.heappop(self.interrupts)[2:]
+                handler(arg)
+            else:
+                self.next_tick += 1000
+                self.handler(self)
+        self.us = end
+
+    def idle(self):
+        """
+        Sleeps until the next interrupt like pyb.wfi().
+        """
+        t = self._next_wake()
+        if t is None:
+            raise RuntimeError('Nothing can wake up the processor')
+        self.advance(t - self.us)
+
+    def disable_irq(self):
+        return True
+
+    def enable_irq(self, state = True):
+        pass
+
+    def micros(self):
+        return self.us
+
+    def millis(self):
+        return self.us // 1000
+
+    def elapsed_micros(self, start):
+        return self.us - start
+
+    def elapsed_millis(self, start):
+        return self.us // 1000 - start